@@ -2,22 +2,30 @@
 Contains functions required to verify deployment address of contract files from a repository
 """
 import os
+import io
+import re
 import asyncio
+import functools
 import concurrent.futures
+import multiprocessing
 import logging
 import subprocess
-import csv
-from bs4 import BeautifulSoup
-from mongoengine import connect, DoesNotExist
+import tempfile
+from collections import defaultdict
+from lxml import html as lxml_html
+from mongoengine import connect
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
 from crytic_compile import CryticCompile, InvalidCompilation
-from semantic_version import SimpleSpec, Version
+from semantic_version import SimpleSpec, NpmSpec, Version
 from objects import DeploymentAddressDetails, Contract, Vulnerability
-from http_methods import make_request
-from csv_processor import read_csv, write_csv
+from http_methods import make_request, is_ok
+from csv_processor import iter_csv, write_csv, CsvAppender
 from patches import get_sol_files, get_commits, clone_repo, get_remappings
 from detector_oyente import execute_oyente, parse_oyente_output
 from detector_slither import execute_slither, parse_slither_output
 from sol_parser import parse_solc
+from utils import write_vulns
 from blacklist_repos import BLACKLIST_REPOS
 
 HEADER = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 \
@@ -28,6 +36,36 @@ FIELDS = ['RepoName', 'ContractName', 'CommitHashes', 'ContractFilePath', 'Deplo
           'SOLC-Version', 'Vulnerabilities']
 # Path to oyente.py
 OYENTE_PATH = ''
+# Contract name -> List of verified deployment addresses, set in each worker process
+CONTRACT_DEPLOYMENTADDR_MAP = {}
+# No. of deployment addresses fetched from Etherscan concurrently
+ETHERSCAN_WORKERS = 8
+# Deployment address -> details fetched from Etherscan by this process but not stored into the database yet
+PENDING_DETAILS = {}
+# No. of pending details which triggers a bulk write
+FLUSH_EVERY = 64
+# Contract name, compiler version, optimization and runs of the Etherscan contract page
+ETHERSCAN_META_RE = re.compile(rb'Contract Name:.*?<span[^>]*>\s*([^<\s]+)\s*</span>'
+                               rb'.*?Compiler Version:?.*?<span[^>]*>\s*v([^<+\s]+)'
+                               rb'.*?Optimization Enabled:.*?<span[^>]*>\s*(?:<b>)?(Yes|No)(?:</b>)?'
+                               rb'\s*with\s*(?:<b>)?(\d+)', re.S)
+ETHERSCAN_BYTECODE_RE = re.compile(rb'<div[^>]*\bid=["\']verifiedbytecode2["\'][^>]*>\s*([0-9a-fA-Fx]*)\s*</div>')
+# Compiler versions which changed the bytecode header/trailer
+SPEC_0_6_0 = SimpleSpec('>=0.6.0')
+SPEC_0_4_22 = SimpleSpec('>=0.4.22')
+SPEC_0_4_7 = SimpleSpec('>=0.4.7')
+# Start of the contract code (free memory pointer setup)
+MARKER_6080 = '6080604052'
+MARKER_6060 = '6060604052'
+# Start of the metadata trailer (`ipfs` and `bzzr0` CBOR keys)
+MARKER_IPFS = 'a264697066735822'
+MARKER_BZZR0 = 'a165627a7a72305820'
+# (compiler versions, header marker, trailer marker) from the newest to the oldest compiler versions
+BYTECODE_MARKERS = (
+    (SPEC_0_6_0, MARKER_6080, MARKER_IPFS),
+    (SPEC_0_4_22, MARKER_6080, MARKER_BZZR0),
+    (SPEC_0_4_7, MARKER_6060, None),
+)
 
 
 def get_contract_deploymentaddr_map():
@@ -41,11 +79,27 @@ def get_contract_deploymentaddr_map():
   
     """
     verified_deployment_addr_path = os.path.dirname(os.getcwd()) + '/verified-contractaddress.csv'
-    verified_deployment_addr = read_csv(verified_deployment_addr_path)
-    contract_deploymentaddr_map = {}
-    for _, ContractAddress, ContractName in verified_deployment_addr[1:]:
-        contract_deploymentaddr_map.setdefault(ContractName, []).append(ContractAddress)
-    return contract_deploymentaddr_map
+    verified_deployment_addr = iter_csv(verified_deployment_addr_path)
+    next(verified_deployment_addr)  # skip header
+    contract_deploymentaddr_map = defaultdict(list)
+    for _, ContractAddress, ContractName in verified_deployment_addr:
+        contract_deploymentaddr_map[ContractName].append(ContractAddress)
+    return dict(contract_deploymentaddr_map)
+
+
+@functools.lru_cache(maxsize=None)
+def get_bytecode_markers(compiler_version):
+    """
+    Function returns the markers of the header and trailer of the bytecode produced by a compiler version.
+
+    :param compiler_version: Compiler version of the contract
+    :return: (header marker, trailer marker or None), None if the bytecode is not trimmed
+    """
+    version = Version(compiler_version)
+    for spec, header, trailer in BYTECODE_MARKERS:
+        if spec.match(version):
+            return header, trailer
+    return None
 
 
 def trim_bytecode(bytecode, compiler_version):
@@ -56,62 +110,126 @@ def trim_bytecode(bytecode, compiler_version):
     :param compiler_version: Supported compiler version of the contract
     :return: Trimmed bytecode of the contract
     """
-    # if compiler version >= 0.6.0
-    if SimpleSpec('>=0.6.0').match(Version(compiler_version)):
-        startswith = bytecode.rfind('6080604052')
-        endswith = bytecode.rfind('a264697066735822')
-        bytecode = bytecode[startswith:endswith]
-    # if compiler version >= 0.4.22
-    elif SimpleSpec('>=0.4.22').match(Version(compiler_version)):
-        startswith = bytecode.rfind('6080604052')
-        endswith = bytecode.rfind('a165627a7a72305820')
-        bytecode = bytecode[startswith:endswith]
-    # if compiler version >= 0.4.7
-    elif SimpleSpec('>=0.4.7').match(Version(compiler_version)):
-        startswith = bytecode.rfind('6060604052')
-        bytecode = bytecode[startswith:]
-    return bytecode
+    markers = get_bytecode_markers(compiler_version)
+    if markers is None:
+        return bytecode
+    header, trailer = markers
+    if trailer is None:
+        return bytecode[bytecode.rfind(header):]
+    # The code starts before the metadata trailer, so only the part before it is searched for the header
+    endswith = bytecode.rfind(trailer)
+    startswith = bytecode.rfind(header, 0, endswith)
+    return bytecode[startswith:endswith]
+
+
+def parse_etherscan_page_regex(content):
+    """Extract contract details from the raw Etherscan page without building the HTML tree
+
+    :param content: Raw content of the contract page
+    :return: (contract name, compiler version, optimized, runs, verified bytecode), None if the page layout differs
+    """
+    meta = ETHERSCAN_META_RE.search(content)
+    bytecode = ETHERSCAN_BYTECODE_RE.search(content)
+    if not meta or not bytecode:
+        return None
+    contract_name, compiler_version, optimized, runs = (group.decode() for group in meta.groups())
+    return contract_name, compiler_version, optimized == 'Yes', int(runs), bytecode.group(1).decode()
+
+
+def parse_etherscan_page_html(content):
+    """Extract contract details from the Etherscan page using its HTML tree
+
+    :param content: Raw content of the contract page
+    :return: (contract name, compiler version, optimized, runs, verified bytecode)
+    """
+    tree = lxml_html.fromstring(content)
+    _, contract_name, _, compiler_version, _, optimized, _, _ = [text for text in tree.xpath(
+        'string(//div[contains(concat(" ", @class, " "), " mx-gutters-lg-1 ")])').split('\n') if text]
+    compiler_version = compiler_version[1:].split('+')[0]
+    optimized, _, runs, _ = optimized.split()
+    verified_bytecode = tree.xpath('string(//div[@id="verifiedbytecode2"])')
+    return contract_name, compiler_version, optimized == 'Yes', int(runs), verified_bytecode
 
 
 def get_contract_details_from_etherscan(deployment_address):
     """
-    The function extract contract details of a deployed contract from the Etherscan database using its deployment address.
+    The function extract contract details of a deployed contract from the Etherscan website using its deployment address.
 
     :param deployment_address: deployment address of the contract
-    :return: DeploymentAddressDetails object containing deployment address information
+    :return: DeploymentAddressDetails object containing deployment address information (not saved)
+    """
+    url = f'https://etherscan.io/address/{deployment_address}#code'
+    response = make_request(url, HEADER)
+    if not is_ok(response):
+        raise Exception(f'Unable to fetch the Etherscan page of {deployment_address}')
+    details = parse_etherscan_page_regex(response.content) or parse_etherscan_page_html(response.content)
+    contract_name, compiler_version, optimized, runs, verified_bytecode = details
+    verified_bytecode = trim_bytecode(verified_bytecode, compiler_version)
+
+    return DeploymentAddressDetails(
+        deployment_address=deployment_address,
+        contract_name=contract_name,
+        compiler_version=compiler_version,
+        optimized=optimized,
+        optimized_runs=runs,
+        blockchain_bytecode=verified_bytecode
+    )
+
+
+def get_deployment_address_details(deployment_addresses):
+    """
+    The function extract contract details of a list of deployment addresses.
+
+    Details are read from the local database in a single query, the missing ones are fetched from
+    Etherscan concurrently and queued for storing into the local database (see `flush_deployment_address_details`).
+
+    :param deployment_addresses: List of deployment addresses
+    :return: Deployment address (key) -> DeploymentAddressDetails object
     """
+    details = {addr: PENDING_DETAILS[addr] for addr in deployment_addresses if addr in PENDING_DETAILS}
+    stored = DeploymentAddressDetails.objects(deployment_address__in=[addr for addr in deployment_addresses
+                                                                      if addr not in details])
+    details.update((obj.deployment_address, obj) for obj in stored)
+    missing = [addr for addr in dict.fromkeys(deployment_addresses) if addr not in details]
+    if not missing:
+        return details
+
+    fetched = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ETHERSCAN_WORKERS) as pool:
+        futures = {pool.submit(get_contract_details_from_etherscan, addr): addr for addr in missing}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                fetched.append(future.result())
+            except Exception as e:
+                logging.error(f'Unable to fetch details of deployment address {futures[future]}')
+                logging.exception(e)
+    for obj in fetched:
+        details[obj.deployment_address] = PENDING_DETAILS[obj.deployment_address] = obj
+    if len(PENDING_DETAILS) >= FLUSH_EVERY:
+        flush_deployment_address_details()
+    return details
+
+
+def flush_deployment_address_details():
+    """Store the pending deployment address details into the local database in a single bulk write"""
+    if not PENDING_DETAILS:
+        return
     try:
-        return DeploymentAddressDetails.objects(deployment_address=deployment_address).get()
-    except DoesNotExist:
-        # If details at deployment address does not exists
-        # Fetch details from etherscan & store into local database
-        url = f'https://etherscan.io/address/{deployment_address}#code'
-        response = make_request(url, HEADER)
-        parsed = BeautifulSoup(response.content, 'html.parser')
-        _, contract_name, _, compiler_version, _, optimized, _, _ = [text for text in parsed.find('div',
-                                                                                                  class_='mx-gutters-lg-1').text.split(
-            '\n') if text]
-        compiler_version = compiler_version[1:].split('+')[0]
-        optimized, _, runs, _ = optimized.split()
-        optimized = bool(optimized == 'Yes')
-        verified_bytecode = parsed.find('div', id='verifiedbytecode2').text
-        verified_bytecode = trim_bytecode(verified_bytecode, compiler_version)
-
-        obj = DeploymentAddressDetails(
-            deployment_address=deployment_address,
-            contract_name=contract_name,
-            compiler_version=compiler_version,
-            optimized=optimized,
-            optimized_runs=int(runs),
-            blockchain_bytecode=verified_bytecode
-        )
-        obj.save()
-        return obj
+        DeploymentAddressDetails._get_collection().bulk_write(
+            [InsertOne(obj.to_mongo()) for obj in PENDING_DETAILS.values()], ordered=False)
+    except BulkWriteError as e:
+        # another process stored some of these addresses meanwhile
+        logging.warning(e.details.get('writeErrors'))
+    PENDING_DETAILS.clear()
 
 
+@functools.lru_cache(maxsize=4096)
 def complie_solc(source, contract_name, compiler_version, remappings='', solc_args=''):
     """Function is used to compile solidity contract and return its trimmed bytecode.
 
+    Results are cached as deployment addresses often share the same compiler settings.  The cache must be
+    cleared whenever the checked out commit changes, as the imported files might differ.
+
     :param source: Path to contract file
     :param contract_name: Name of the contract whose bytecode is required
     :param compiler_version: Compiler version requirement of the contract file
@@ -127,18 +245,55 @@ def complie_solc(source, contract_name, compiler_version, remappings='', solc_ar
         return None
 
 
-def verify_contract_deployment_address(contract_name, contract_file, deployment_addresses, remappings):
+def get_pragma_spec(ast):
+    """Extract the compiler version requirement of a contract file
+
+    :param ast: AST of the contract file
+    :return: NpmSpec of the solidity pragma, None if not found or unsupported
+    """
+    for child in ast['children']:
+        if child['type'] == 'PragmaDirective' and child['name'] == 'solidity':
+            try:
+                return NpmSpec(' <'.join(child['value'].split('<')))
+            except ValueError:
+                return None
+    return None
+
+
+def is_compiler_allowed(pragma_spec, compiler_version):
+    """Check if a contract file can be compiled by a compiler version at all
+
+    :param pragma_spec: NpmSpec of the solidity pragma of the contract file (None allows any version)
+    :param compiler_version: Compiler version
+    :return: False if the pragma rules out the compiler version else True
+    """
+    if pragma_spec is None:
+        return True
+    try:
+        return pragma_spec.match(Version(compiler_version))
+    except ValueError:
+        return True
+
+
+def verify_contract_deployment_address(contract_name, contract_file, deployment_addresses, remappings,
+                                       pragma_spec=None):
     """The function is used to verify the deployment address of a contract from etherscan database.
 
     :param contract_name: Name of the contract
     :param contract_file: Path to contract file
     :param deployment_addresses: List of possible deployment addresses
     :param remappings: String containing library remappings required to compile contract
+    :param pragma_spec: NpmSpec of the solidity pragma of the contract file, used to skip deployment
+    addresses compiled with a version which cannot compile the contract file
     :return: deployment_address: Verified deployment address of the contract if found, otherwise None
     :return: compiler_version: Compiler version of the contract obtained from etherscan
     """
+    details = get_deployment_address_details(deployment_addresses)
     for deployment_address in deployment_addresses:
-        obj = get_contract_details_from_etherscan(deployment_address)
+        obj = details.get(deployment_address)
+        # solc refuses to compile the file, skip without invoking it
+        if obj is None or not is_compiler_allowed(pragma_spec, obj.compiler_version):
+            continue
         solc_args = ''
         if obj.optimized:
             solc_args = f'--optimize --optimize-runs {obj.optimized_runs}'
@@ -149,8 +304,27 @@ def verify_contract_deployment_address(contract_name, contract_file, deployment_
     return None, None  # deployment address match not found
 
 
+def parse_solc_at_commit(repo, repo_path, contract_file, commit):
+    """Parse a contract file as of a given commit without checking out the commit
+
+    :param repo: Git object reference to repository
+    :param repo_path: Absolute path of the repository
+    :param contract_file: Absolute path to contract file
+    :param commit: Commit hash
+    :return: (AST of the contract file, error)
+    """
+    try:
+        content = repo.git.show(f'{commit}:{os.path.relpath(contract_file, repo_path)}', stdout_as_string=False)
+    except Exception as e:
+        return None, e
+    with tempfile.NamedTemporaryFile(suffix='.sol') as blob_file:
+        blob_file.write(content)
+        blob_file.flush()
+        return parse_solc(blob_file.name)
+
+
 def process_contract(repo, full_name, repo_path, contract_file, contract_deploymentaddr_map, remappings,
-                     contract_csv_path):
+                     contract_csv):
     """Function iterates all the commits versions of each contract and try to verify deployment address
     for each version
 
@@ -160,84 +334,103 @@ def process_contract(repo, full_name, repo_path, contract_file, contract_deploym
     :param contract_file: Name of the contract file
     :param contract_deploymentaddr_map: Map containing contract names and deployment addresses
     :param remappings: Library remappings
-    :param contract_csv_path: Absolute path to contract csv file for writing results
+    :param contract_csv: CsvAppender of the contract csv file for writing results
     """
     global OYENTE_PATH
-    # reset repo state before setching commits
-    repo.git.clean('-xdf')
-    repo.git.checkout('master')
-    commits = get_commits(repo, contract_file)
+    # listing the commits reads the history only, the checked out commit does not matter
+    commits = get_commits(repo, 'master', contract_file)
     # Iterate each contract version by version
     # starting from latest towards oldest
     found = False
     for commit in commits:
         if found:
             return
-        repo.git.clean('-xdf')
-        repo.git.checkout(commit)
-        parsed, err = parse_solc(contract_file)
+        parsed, err = parse_solc_at_commit(repo, repo_path, contract_file, commit)
         if err:
             logging.error(err)
             continue
-        for child in parsed['children']:
-            if child['type'] == 'ContractDefinition':
-                contract_name = child['name']
-                if contract_name not in contract_deploymentaddr_map.keys():
-                    continue
-                deployment_address, version = verify_contract_deployment_address(contract_name,
-                                                                                 contract_file,
-                                                                                 contract_deploymentaddr_map[
-                                                                                     contract_name],
-                                                                                 remappings)
-                if deployment_address:
-                    found = True
-                    vuln_slither = []
-                    vuln_col = []
-                    out_json = execute_slither(contract_file, version, remappings)
-                    if out_json != 'null':
-                        vuln_slither = parse_slither_output(out_json, parsed, contract_file)
-                        vuln_col.append('Slither:' + '|'.join(
-                            f'{v.vuln_name}(' + ':'.join(str(v) for v in v.line_num) + ')' for v in vuln_slither))
-                    vuln_oyente = []
-                    out_json = execute_oyente(OYENTE_PATH, contract_file, version, remappings)
-                    if out_json != 'null':
-                        vuln_oyente = parse_oyente_output(out_json, parsed, contract_file)
-                        vuln_col.append('Oyente:' + '|'.join(
-                            f'{v.vuln_name}(' + ':'.join(str(v) for v in v.line_num) + ')' for v in vuln_oyente))
-
-                    with open(contract_csv_path, 'a') as csvfile:
-                        writer = csv.DictWriter(csvfile, fieldnames=FIELDS)
-                        writer.writerow(Contract(
-                            full_name,
-                            contract_name,
-                            commit,
-                            contract_file,
-                            deployment_address,
-                            version,
-                            ';'.join(vuln_col)
-                        ).toDictWriterRow())
-                    break
-
-
-def process_repo_contracts(full_name, data_dir, contract_deploymentaddr_map, contract_csv_path):
+        contract_names = [child['name'] for child in parsed['children']
+                          if child['type'] == 'ContractDefinition' and child['name'] in contract_deploymentaddr_map]
+        # checkout the commit only if one of its contracts has possible deployment addresses
+        if not contract_names:
+            continue
+        repo.git.clean('-xdf')
+        repo.git.checkout(commit)
+        complie_solc.cache_clear()
+        pragma_spec = get_pragma_spec(parsed)
+        for contract_name in contract_names:
+            deployment_address, version = verify_contract_deployment_address(contract_name,
+                                                                             contract_file,
+                                                                             contract_deploymentaddr_map[
+                                                                                 contract_name],
+                                                                             remappings,
+                                                                             pragma_spec)
+            if deployment_address:
+                found = True
+                # both detectors spend their time in child processes, run them side by side
+                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as detectors:
+                    slither_future = detectors.submit(execute_slither, contract_file, version, remappings)
+                    oyente_future = detectors.submit(execute_oyente, OYENTE_PATH, contract_file, version, remappings)
+                vuln_col = io.StringIO()
+                out_json = slither_future.result()
+                if out_json != 'null':
+                    write_vulns(vuln_col, 'Slither', parse_slither_output(out_json, parsed, contract_file))
+                out_json = oyente_future.result()
+                if out_json != 'null':
+                    write_vulns(vuln_col, 'Oyente', parse_oyente_output(out_json, parsed, contract_file))
+
+                contract_csv.writerow(Contract(
+                    full_name,
+                    contract_name,
+                    commit,
+                    contract_file,
+                    deployment_address,
+                    version,
+                    vuln_col.getvalue()
+                ).toDictWriterRow())
+                break
+
+
+def init_worker(oyente_path, contract_deploymentaddr_map):
+    """Function initialises the globals of a worker process, once per process rather than once per repository
+
+    :param oyente_path: Absolute path to Oyente
+    :param contract_deploymentaddr_map: Map containing contract names and deployment addresses
+    """
+    global OYENTE_PATH
+    global CONTRACT_DEPLOYMENTADDR_MAP
+    OYENTE_PATH = oyente_path
+    CONTRACT_DEPLOYMENTADDR_MAP = contract_deploymentaddr_map
+    # connect to database of deployment addresses, the client must not be shared across forks
+    connect('deployment-address-details', maxPoolSize=64)
+
+
+def process_repo_contracts(full_name, data_dir, contract_csv_path):
     """Function tries to verify the deployment address of all the contract files in a given repository
 
     :param full_name: Name of the repository including user name
     :param data_dir: Absolute path to directory for cloning repository
-    :param contract_deploymentaddr_map: Map containing contract names and deployment addresses
     :param contract_csv_path: Absolute path to contract csv file for writing results
     """
     repo_path = data_dir + '/' + full_name.replace('/', '__')
     repo = clone_repo(full_name, repo_path)
     repo_path += '/' + full_name.split('/')[1]
+    # reset repo state once, each contract file checks out the commits it needs
+    repo.git.clean('-xdf')
+    repo.git.checkout('master')
 
     remappings = get_remappings(repo_path)
     # get contract files
     contract_files = get_sol_files(repo_path)
 
-    for contract_file in contract_files:
-        process_contract(repo, full_name, repo_path, contract_file, contract_deploymentaddr_map, remappings,
-                         contract_csv_path)
+    # keep the csv file open across all the contract files, results are written once the repo is done
+    try:
+        with CsvAppender(contract_csv_path, FIELDS) as contract_csv:
+            for contract_file in contract_files:
+                process_contract(repo, full_name, repo_path, contract_file, CONTRACT_DEPLOYMENTADDR_MAP, remappings,
+                                 contract_csv)
+    finally:
+        flush_deployment_address_details()
 
 
 async def fetch_contracts(_OYENTE_PATH, PROCESSES):
@@ -246,17 +439,13 @@ async def fetch_contracts(_OYENTE_PATH, PROCESSES):
     :param _OYENTE_PATH: Absolute path to Oyente
     :param PROCESSES: Number of concurrent processes
     """
-    global OYENTE_PATH
-    OYENTE_PATH = _OYENTE_PATH
-    # connect to database of deployment addresses
-    connect('deployment-address-details')
-
     # path for Repos.csv
     repo_csv_path = os.path.dirname(os.getcwd())
-    repo_data = read_csv(repo_csv_path + '/Repos.csv')
+    repo_data = iter_csv(repo_csv_path + '/Repos.csv')
+    next(repo_data)  # skip header
 
     contract_csv_path = os.path.dirname(os.getcwd()) + '/Contract.csv'
-    write_csv(contract_csv_path, FIELDS)
+    write_csv(contract_csv_path, [FIELDS])
 
     # directory for storing repos
     data_dir = os.getcwd() + '/data'
@@ -268,12 +457,15 @@ async def fetch_contracts(_OYENTE_PATH, PROCESSES):
     # async tasks
     tasks = []
     loop = asyncio.get_running_loop()
-    with concurrent.futures.ProcessPoolExecutor(max_workers=PROCESSES) as pool:
-        for row in repo_data[1:]:
+    # workers are forked after the map is loaded so they inherit it instead of receiving a pickled copy per task
+    with concurrent.futures.ProcessPoolExecutor(max_workers=PROCESSES, mp_context=multiprocessing.get_context('fork'),
+                                                initializer=init_worker,
+                                                initargs=(_OYENTE_PATH, contract_deploymentaddr_map)) as pool:
+        for row in repo_data:
             if row[0] in BLACKLIST_REPOS:
                 continue
             tasks.append(loop.run_in_executor(pool, process_repo_contracts,
-                                              row[0], data_dir, contract_deploymentaddr_map, contract_csv_path))
+                                              row[0], data_dir, contract_csv_path))
 
     await asyncio.wait(tasks)
 
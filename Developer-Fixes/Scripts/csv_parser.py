@@ -8,9 +8,14 @@ import csv
 
 
 def parse_csv(csvStr: str, recordCls: Type[Record]) -> Iterable[Record]:
-    reader = csv.DictReader(csvStr.splitlines())
-    records = tuple(recordCls.fromCSVRow(row=r, fieldname=reader.fieldnames) for r in reader)
-    return records
+    # Records are built lazily, use `tuple(...)` on the result when a sequence is needed
+    reader = csv.reader(csvStr.splitlines())
+    header = next(reader, None)
+    if header is None:
+        return ()
+    idx = recordCls.indexMap(header)
+    # blank and truncated rows have no value for some of the fields, they are skipped
+    return (recordCls.fromRow(row, idx) for row in reader if len(row) >= len(header))
 
 
 def parse_patches_csv(csvStr: str) -> Iterable[Patch]:
@@ -2,17 +2,110 @@
 Contains functions to read and write to a csv file
 """
 import csv
+import io
+import re
 
-def write_csv(filename, row):
-    with open(filename, 'a') as csvfile:
+# Size of the write buffer of the csv files opened for appending
+WRITE_BUFFERING = 1 << 20
+# Line terminator of the default `excel` dialect used by the csv writers
+LINE_TERMINATOR = csv.excel.lineterminator
+# Characters forcing a field to be quoted by the csv writers
+_NEEDS_QUOTING = re.compile(r'["\r\n]')
+
+
+def write_csv(filename, rows):
+    """Append rows to a csv file
+
+    :param filename: Path to the csv file
+    :param rows: List of rows to append
+    """
+    with open(filename, 'a', buffering=WRITE_BUFFERING, newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(row)
+        writer.writerows(rows)
+
+
+def _format_plain_row(row):
+    """Format a row of plain strings without separators, quotes or line breaks, which need no quoting
+
+    :param row: List row
+    :return: The row formatted as by `csv.writer` (without line terminator), None if the row needs `csv.writer`
+    """
+    try:
+        line = ','.join(row)
+    except TypeError:
+        return None
+    if line and line.count(',') == len(row) - 1 and not _NEEDS_QUOTING.search(line):
+        return line
+    return None
+
+
+class CsvAppender:
+    """Keeps a csv file open for appending across many rows
+
+    Rows are accumulated in memory and written out on `flush` (or on exit) in a single write,
+    so that concurrent processes appending to the same file never interleave partial rows.
+    """
+
+    def __init__(self, filename, fieldnames=None, batch_size=None):
+        """
+        :param filename: Path to the csv file
+        :param fieldnames: Field names of the dict rows passed to `writerow`, None to write list rows
+        :param batch_size: If given, buffered rows are written out every `batch_size` rows
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self._pending = 0
+        self._file = None
+        self._buffer = io.StringIO()
+        self._fieldnames = fieldnames
+        if fieldnames is None:
+            self._writer = csv.writer(self._buffer)
+        else:
+            self._writer = csv.DictWriter(self._buffer, fieldnames=fieldnames)
+
+    def __enter__(self):
+        self._file = open(self.filename, 'a', buffering=WRITE_BUFFERING, newline='')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def writerow(self, row):
+        line = _format_plain_row(row) if self._fieldnames is None else None
+        if line is None:
+            self._writer.writerow(row)
+        else:
+            self._buffer.write(line)
+            self._buffer.write(LINE_TERMINATOR)
+        self._pending += 1
+        if self.batch_size and self._pending >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        data = self._buffer.getvalue()
+        if data:
+            self._file.write(data)
+            self._file.flush()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        self._pending = 0
+
+
+def iter_csv(filename):
+    """Stream the rows of a csv file
+
+    :param filename: Path to the csv file
+    :return: Generator of rows
+    """
+    with open(filename, 'rt', newline='') as csvfile:
+        yield from csv.reader(csvfile)
+
 
 def read_csv(filename):
-    data = []
-    with open(filename, 'rt') as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            data.append(row)
-    
-    return data
\ No newline at end of file
+    return list(iter_csv(filename))
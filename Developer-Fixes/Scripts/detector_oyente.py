@@ -11,28 +11,18 @@ from pathlib import Path
 from objects import Vulnerability
 from utils import *
 
+# Options following `-s <contract file>`, the allowed path is appended at run time
+OYENTE_ARGV_OPTIONS = ('-j', '--web', '--allow-paths')
 log = logging.getLogger('oyente')
 
-def get_function_name(node, line):
+def get_function_name(function_index, line):
     """Extract name of the function to which a line of code belongs
 
-    :param node: AST node of the contract file
+    :param function_index: Function index of the contract file from `build_function_index`
     :param line: line number
     :return: Name of the function (if found otherwise unknown)
     """
-    for child in node['children']:
-        start_line = child['loc']['start']['line']
-        end_line = child['loc']['end']['line']
-        if line >= start_line and line <= end_line:
-            if not get_attr(child, 'subNodes'):
-                continue
-            for subNode in child['subNodes']:
-                start_line_subNode = subNode['loc']['start']['line']
-                end_line_subNode = subNode['loc']['end']['line']
-                if subNode['type'] == 'FunctionDefinition' and line >= start_line_subNode and line <= end_line_subNode:
-                    return subNode['name']
-
-    return 'unknown'
+    return find_function(function_index, line) or 'unknown'
 
 def execute_oyente(oyente_root, filepath, version, remapping):
     """Runs oyente on a contract file
@@ -46,10 +36,9 @@ def execute_oyente(oyente_root, filepath, version, remapping):
     try:
         log.info(f'Executing oyente on : {filepath}')
         env = { **os.environ, 'SOLC_VERSION': version }
-        args = ['python3', oyente_root, '-s', filepath, '-j', '--web', '--allow-paths', os.getcwd()]
+        args = ['python3', oyente_root, '-s', filepath, *OYENTE_ARGV_OPTIONS, os.getcwd()]
         if remapping:
-            args.append(F'-rmp')
-            args.append(remapping)
+            args += ('-rmp', remapping)
         proc = subprocess.run(args, capture_output=True, env=env, text=True)
         log.info(proc.stdout)
         log.error(proc.stderr)
@@ -60,19 +49,20 @@ def execute_oyente(oyente_root, filepath, version, remapping):
         return 'null'
     return out_json
 
-def get_vuln_object(vuln_name, contract_file_path, contract_name, line_num, ast):
+def get_vuln_object(vuln_name, contract_file_path, contract_name, line_num, function_index, node_index):
     """Create Vulnerability object for vulnerability data
 
     :param vuln_name: Name of vulnerability
     :param contract_file_path: Absolute path to contract file
     :param contract_name: Name of the contract
     :param line_num: Line number of the vulnerability
-    :param ast: AST of the contract file
+    :param function_index: Function index of the contract file
+    :param node_index: Node index of the contract file from `build_node_index`
     :return: Vulnerability object
     """
-    function_name = get_function_name(ast, int(line_num))
+    function_name = get_function_name(function_index, int(line_num))
     try:
-        ast_node, ast_node_path = get_node_and_node_path(ast, int(line_num))
+        ast_node, ast_node_path = find_node(node_index, int(line_num))
     except Exception as e:
         log.exception(e)
         return None
@@ -88,25 +78,27 @@ def parse_oyente_output(out_json, ast, sol_file):
     :param sol_file: Absolute path to contract file
     :return: List of vulnerability objects
     """
+    entry = out_json.get(sol_file)
+    if entry is None:
+        return []
     vulnerabilities = []
-    for c_filepath, f in out_json.items():
-        if c_filepath != sol_file:
-            continue
-        for c_name, data in f.items():
-            for v_name, vulns in data['vulnerabilities'].items():
-                if vulns:
-                    for vuln in vulns:
-                        if isinstance(vuln, str):
-                            line_num = vuln.split(':')[1]
+    function_index = build_function_index(ast)
+    node_index = build_node_index(ast)
+    for c_name, data in entry.items():
+        for v_name, vulns in data['vulnerabilities'].items():
+            if vulns:
+                for vuln in vulns:
+                    if isinstance(vuln, str):
+                        line_num = vuln.split(':')[1]
+                        vulnerabilities.append(
+                            get_vuln_object(v_name, sol_file, c_name,
+                            line_num, function_index, node_index)
+                        )
+                    elif isinstance(vuln, list):
+                        for v in vuln:
+                            line_num = v.split(':')[1]
                             vulnerabilities.append(
-                                get_vuln_object(v_name, c_filepath, c_name,
-                                line_num, ast)
+                                get_vuln_object(v_name, sol_file, c_name,
+                                line_num, function_index, node_index)
                             )
-                        elif isinstance(vuln, list):
-                            for v in vuln:
-                                line_num = v.split(':')[1]
-                                vulnerabilities.append(
-                                    get_vuln_object(v_name, c_filepath, c_name,
-                                    line_num, ast)
-                                )
     return vulnerabilities
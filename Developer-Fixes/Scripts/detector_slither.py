@@ -11,6 +11,8 @@ from objects import Vulnerability
 from utils import *
 
 SLITHER_DETECTORS = 'name-reused,rtlo,shadowing-state,suicidal,uninitialized-state,uninitialized-storage,arbitrary-send,controlled-delegatecall,reentrancy-eth,incorrect-equality,locked-ether,reentrancy-no-eth,unchecked-send,reentrancy-benign,reentrancy-events'
+# `None` is the placeholder for the contract file path
+SLITHER_ARGV_BASE = ('slither', None, '--json', '-', '--json-types', 'detectors', '--detect', SLITHER_DETECTORS)
 log = logging.getLogger('slither')
 
 def execute_slither(filepath, version, remapping):
@@ -24,10 +26,10 @@ def execute_slither(filepath, version, remapping):
     try:
         log.info(f'Executing slither on : {filepath}')
         env = { **os.environ, 'SOLC_VERSION': version }
-        args = ['slither', filepath, '--json', '-', '--json-types', 'detectors', '--detect', F'{SLITHER_DETECTORS}']
+        args = list(SLITHER_ARGV_BASE)
+        args[1] = filepath
         if remapping:
-            args.append(F'--solc-remaps')
-            args.append(F'{remapping}')
+            args += ('--solc-remaps', remapping)
         proc = subprocess.run(args, capture_output=True, env=env, text=True)
         log.info(proc.stdout)
         log.error(proc.stderr)
@@ -45,28 +47,31 @@ def parse_slither_output(out_json, ast, sol_file):
     vulns = []
     if not detectors:
         return vulns
+    node_index = build_node_index(ast)
     for detector in detectors:
-        elements = get_attr(detector, 'elements')
-        if not elements:
+        elements = detector.get('elements')
+        # without node elements there are no lines to report
+        if not elements or not any(element.get('type') == 'node' for element in elements):
             continue
         lines = []
         isImported = False
         for element in elements:
-            if get_attr(element, 'type') == 'function':
-                function_name = get_attr(element, 'name')
-                contract_name = get_attr(get_attr(get_attr(element, 'type_specific_fields'), 'parent'), 'name')
-            elif get_attr(element, 'type') == 'node':
-                lines += get_attr(get_attr(element, 'source_mapping'), 'lines')
-            file_name_used = get_attr(get_attr(element, 'source_mapping'), 'filename_used')
-            if file_name_used != sol_file:
+            element_type = element.get('type')
+            source_mapping = element.get('source_mapping') or {}
+            if element_type == 'function':
+                function_name = element.get('name')
+                contract_name = ((element.get('type_specific_fields') or {}).get('parent') or {}).get('name')
+            elif element_type == 'node':
+                lines += source_mapping.get('lines') or []
+            if source_mapping.get('filename_used') != sol_file:
                 isImported = True
                 break
         if not lines or isImported:
             continue
-        vuln_name = get_attr(detector, 'check')
+        vuln_name = detector.get('check')
         line_num = ':'.join(str(l) for l in lines)
         try:
-            ast_node, ast_node_path = get_node_and_node_path(ast, lines[0])
+            ast_node, ast_node_path = find_node(node_index, lines[0])
         except Exception as e:
             log.exception(e)
             continue
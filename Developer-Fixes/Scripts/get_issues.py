@@ -1,9 +1,11 @@
 """
 The file is used to collect GitHub issues data for given list of repositories
 """
-from http_methods import make_request
+from http_methods import make_request, is_ok
 from csv_processor import read_csv
 from bs4 import BeautifulSoup
+from itertools import chain
+import concurrent.futures
 import os
 import logging
 from blacklist_repos import BLACKLIST_REPOS
@@ -11,73 +13,111 @@ from blacklist_repos import BLACKLIST_REPOS
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+GITHUB = 'https://github.com/'
+HEADER = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36',
+          'Cookie': '',
+          "Content-Type": "text/html; charset=utf-8"}
+# BeautifulSoup backend used for the issue pages
+HTML_PARSER = 'lxml'
+# No. of pages fetched concurrently, requests are still spaced by the budget of `make_request`
+ISSUE_WORKERS = 8
+
+
 def get_total_pages(parsed):
     pages = 1
     try:
-        pages = int(parsed.find('div', class_='paginate-container').text.split(' ')[-2])
+        pages = int(parsed.select_one('div.paginate-container').text.split(' ')[-2])
     except:
         #If only a single page is required then 'paginate-container' is empty
         pass
     return pages
 
-root = os.path.dirname(os.getcwd())
-repo_data = read_csv(root + '/Repos.csv')
 
-GITHUB = 'https://github.com/'
-HEADER = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36',
-          'Cookie': '',
-          "Content-Type": "text/html; charset=utf-8"}
+def list_issue_links(full_name, page):
+    """Extract the links of all issues on a page of the issue list of a repository
+
+    :param full_name: Full name of the repository
+    :param page: Page number
+    :return: List of issue links
+    """
+    response = make_request(GITHUB + full_name + '/issues?q=is%3Aissue&page=' + str(page), HEADER)
+    if not is_ok(response):
+        logger.error(f'Unable to fetch page {page} of the issues of {full_name}')
+        return []
+    parsed = BeautifulSoup(response.content, HTML_PARSER)
+    divs = parsed.select('div.Box-row--focus-gray')
+    return [div.select_one('a.link-gray-dark').attrs['href'] for div in divs]
+
+
+def store_issue(folder, repo_name, issue_link):
+    """Save the html page and the discussion of an issue
 
-#setup directory for Issues data
-os.chdir(root)
-if not os.path.exists('IssuesData'):
-    os.mkdir('IssuesData')
-os.chdir('IssuesData')
+    :param folder: Absolute path to the issue data of the repository
+    :param repo_name: Name of the repository
+    :param issue_link: Link of the issue
+    """
+    response = make_request(GITHUB + issue_link[1:], HEADER)
+    if not is_ok(response):
+        logger.error(f'Unable to fetch issue {issue_link}')
+        return
+    filename = os.path.join(folder, repo_name + '_' + issue_link.split('/')[-1])
 
-for row in repo_data[1:]:
-    row = row[0]
-    # print('Processing  ' + row)
-    repo_name = row.split('/')[1]
+    #save html response of issue to reponame_issueID.html
+    with open(filename + '.html', 'w') as f:
+        f.write(response.content.decode('utf-8'))
 
-    #Skip blacklisted repo
-    if row in BLACKLIST_REPOS:
-        continue
+    parsed = BeautifulSoup(response.content, HTML_PARSER)
+    div = parsed.select_one('div.js-discussion')
+    text = div.text.split('\n')
+    result = [x.strip() + '\n' for x in text if x.strip() != '']
+
+    #save discussion of issue to reponame_issueID.txt
+    with open(filename + '.txt', 'w') as f:
+        f.writelines(result)
+
+
+def fetch_issues(pool, issues_dir, full_name):
+    """Save all the issues of a repository
+
+    :param pool: Thread pool used to fetch pages concurrently
+    :param issues_dir: Absolute path to the issue data
+    :param full_name: Full name of the repository
+    """
+    repo_name = full_name.split('/')[1]
 
     #store issue data in subdir named as USERNAME__REPONAME
-    folder_name = row.replace('/', '__')
-    if not os.path.exists(folder_name):
-        os.mkdir(folder_name)
+    folder = os.path.join(issues_dir, full_name.replace('/', '__'))
+    os.makedirs(folder, exist_ok=True)
 
-    os.chdir(folder_name)
-    
     #get total number of pages
-    response = make_request(GITHUB + row + '/issues?q=is%3Aissue', HEADER)
-    parsed = BeautifulSoup(response.content, 'html.parser')
+    response = make_request(GITHUB + full_name + '/issues?q=is%3Aissue', HEADER)
+    if not is_ok(response):
+        logger.error(f'Unable to fetch the issues of {full_name}')
+        return
+    parsed = BeautifulSoup(response.content, HTML_PARSER)
     pages = get_total_pages(parsed)
-    
-    #for each page
-    #get all issues on current page
-    for page in range(1, pages+1):
-        response = make_request(GITHUB + row + '/issues?q=is%3Aissue&page=' + str(page), HEADER)
-        parsed = BeautifulSoup(response.content, 'html.parser')
-        divs = parsed.findAll('div', class_='Box-row--focus-gray')
-        for div in divs:
-            issue_link = div.find('a', class_='link-gray-dark').attrs['href']
-            response = make_request(GITHUB + issue_link[1:], HEADER)
-
-            #save html response of issue to reponame_issueID.html
-            f = open(repo_name + '_' + issue_link.split('/')[-1] + '.html', 'w')
-            f.write(response.content.decode('utf-8'))
-            f.close()
-
-            parsed = BeautifulSoup(response.content, 'html.parser')
-            div = parsed.find('div', class_='js-discussion')
-            text = div.text.split('\n')
-            result = [x.strip() + '\n' for x in text if x.strip() != '']
-
-            #save discussion of issue to reponame_issueID.txt
-            f = open(repo_name + '_' + issue_link.split('/')[-1] + '.txt', 'w')
-            f.writelines(result)
-            f.close()
-    
-    os.chdir('..')
+
+    #get all issues on every page, then fetch all issues
+    issue_links = chain.from_iterable(pool.map(lambda page: list_issue_links(full_name, page), range(1, pages+1)))
+    for _ in pool.map(lambda issue_link: store_issue(folder, repo_name, issue_link), issue_links):
+        pass
+
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.getcwd())
+    repo_data = read_csv(root + '/Repos.csv')
+
+    #setup directory for Issues data
+    issues_dir = os.path.join(root, 'IssuesData')
+    os.makedirs(issues_dir, exist_ok=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ISSUE_WORKERS) as pool:
+        for row in repo_data[1:]:
+            row = row[0]
+            # print('Processing  ' + row)
+
+            #Skip blacklisted repo
+            if row in BLACKLIST_REPOS:
+                continue
+
+            fetch_issues(pool, issues_dir, row)
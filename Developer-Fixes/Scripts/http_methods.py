@@ -1,35 +1,88 @@
 """
 Contains functions to perform HTTP requests
 """
+import os
 import requests
-from random import randint, sample
-from time import sleep
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from time import sleep, monotonic
 import logging
 
+# Minimum number of seconds between two requests made by a process
+MIN_REQUEST_INTERVAL = 2
+# Number of attempts before giving up on a url
+MAX_ATTEMPTS = 5
+# Seconds to wait after the first failed attempt, doubled after each failure
+BACKOFF_BASE = 5
+
+_rate_lock = threading.Lock()
+_next_request_time = 0.0
+_session = None
+_session_pid = None
+
+
+def get_session():
+    """Return the HTTP session of the process, keeping connections alive across requests
+
+    Pooled connections must not be shared with forked processes, so each process creates its own session.
+    """
+    global _session
+    global _session_pid
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64,
+                              max_retries=Retry(total=3, backoff_factor=1.5, raise_on_status=False,
+                                                status_forcelist=[429, 500, 502, 503, 504]))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def wait_for_rate_limit():
+    """Block until the request budget of the process allows the next request"""
+    global _next_request_time
+    with _rate_lock:
+        now = monotonic()
+        wait_time = _next_request_time - now
+        _next_request_time = max(now, _next_request_time) + MIN_REQUEST_INTERVAL
+    if wait_time > 0:
+        logging.info('waiting for ' + str(round(wait_time, 2)) + ' seconds before next request')
+        sleep(wait_time)
+
+
 def make_request(url, headers):
     """Perform HTTP request to given url
 
     :param url: URL
     :param headers: Custom HTTP headers
-    :return: HTTP response
+    :return: HTTP response (last response received if all attempts failed)
     """
-    # wait for random time
-    wait_time = randint(2, 4)
-    logging.info('waiting for '+ str(wait_time) + ' seconds before next request')
-    sleep(wait_time)
     response = None
-    try:
-        logging.info('making http request to : ' + url)
-        response = requests.get(url, timeout=10, headers=headers)
-        if response.status_code != 200:
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            backoff = BACKOFF_BASE * 2 ** (attempt - 1)
+            logging.info('Retrying after ' + str(backoff) + ' seconds')
+            sleep(backoff)
+        wait_for_rate_limit()
+        try:
+            logging.info('making http request to : ' + url)
+            response = get_session().get(url, timeout=10, headers=headers)
+            if response.status_code == 200:
+                return response
             logging.error('Invalid Response for url : ' + url)
-            logging.info('Retrying after 30 seconds')
-            sleep(30)
-            response = make_request(url, headers)
-    except Exception as e:
-        logging.exception(e)
-        logging.info('Retrying after 20 seconds')
-        sleep(20)
-        response = make_request(url, headers)
-    
-    return response
\ No newline at end of file
+        except Exception as e:
+            logging.exception(e)
+
+    logging.error('Giving up on url : ' + url)
+    return response
+
+
+def is_ok(response):
+    """Check if a response of `make_request` succeeded, the last failed response is returned once it gives up
+
+    :param response: HTTP response, None if no response was received
+    :return: True if the response has status 200 else False
+    """
+    return response is not None and response.status_code == 200
@@ -4,43 +4,64 @@ Python object corresponds to each record in our CSV files in this dataset
 Requires Python >= 3.7
 """
 
-from pathlib import Path
-from typing import Dict, Optional, Iterable, Tuple, Mapping, Any, Type, ClassVar
+from typing import Dict, Optional, Iterable, Tuple, Mapping, Any, Type, ClassVar, Sequence, List
 import attr
 from abc import ABC, abstractmethod
 from csv import DictReader, DictWriter
 from datetime import datetime
 import re
-import json
-from deepdiff import DeepDiff
+import functools
+from types import MappingProxyType
 from mongoengine import Document, StringField, IntField, BooleanField
 
-def convert_if_type_mismatch(self, attrib, val):
-    return val if isinstance(val, attrib.type) else attr.setters.convert(self, attrib, val)
+# Separator of the vulnerabilities listed for a detector, e.g. `name(1:2)|name(3)`
+_VULN_SPLIT_RE = re.compile(r'\)\|*')
 
-attr_on_setattr_convert_if_type_mismatch = [convert_if_type_mismatch, attr.setters.validate]
+def _freeze(o):
+    """Convert a json object to nested tuples that can be hashed and compared
+
+    :param o: Json object
+    :return: Dicts as tuples of sorted (key, value) pairs, lists as tuples
+    """
+    if isinstance(o, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in o.items()))
+    if isinstance(o, list):
+        return tuple(_freeze(v) for v in o)
+    return o
+
+def convert_prid(value):
+    return None if value == 'null' else int(value)
+
+def convert_issue_ids(value, _int=int):
+    return None if value == 'null' else tuple(map(_int, filter(None, value.split(';'))))
+
+def convert_semicolon_list(value):
+    return tuple(value.split(';'))
+
+def convert_line_num(value, _int=int):
+    return tuple(map(_int, value.split(':')))
 
 def convert_vuln(value):
-    return { tuple(detectors.split('|')) : tuple( v+')' for v in re.split('\)\|*', vuls) if v) for detectors, vuls in (x.split(':', maxsplit=1) for x in value.split(';')) }
+    return { tuple(detectors.split('|')) : tuple( v+')' for v in _VULN_SPLIT_RE.split(vuls) if v) for detectors, vuls in (x.split(':', maxsplit=1) for x in value.split(';')) }
 
 
-@attr.s(auto_attribs=True, init=False)
+@attr.s(auto_attribs=True, init=False, slots=True)
 class Record(ABC):
     # Note: following intentioanlly unmodifiable when instantiating
     _CUSTOM_CSV_FIELD_NAMES_MAP: ClassVar[Dict[str, str]] = {} # From class attribute name to specific CSV field name
     
-    # From CSV field name to class attribute name. By default, they are assumed to be the same unless specified by `self._CUSTOM_CSV_FIELD_NAMES_MAP`
-    __CSV_FIELD_NAMES_MAP: ClassVar[Optional[Dict[str, str]]] = None # Note: this is a cache object, access with `_get_csv_field_map` instead
-    
     @classmethod
-    def _get_csv_field_map(selfCls) -> Dict[str, str]:
-        
-        if selfCls.__CSV_FIELD_NAMES_MAP is None:
-            selfClsFields = tuple(attr.fields_dict(selfCls).keys())
-            assert all(f in selfClsFields for f in selfCls._CUSTOM_CSV_FIELD_NAMES_MAP.keys() ), '_CUSTOM_CSV_FIELD_NAMES_MAP has unknown keys!'
-            selfCls.__CSV_FIELD_NAMES_MAP = { **{ f: f for f in selfClsFields },
-                                             **{ csv_field: cls_field for cls_field, csv_field in selfCls._CUSTOM_CSV_FIELD_NAMES_MAP.items() } }
-        return selfCls.__CSV_FIELD_NAMES_MAP
+    @functools.lru_cache(maxsize=None)
+    def _get_csv_field_map(selfCls) -> Mapping[str, str]:
+        """
+        Return the map from CSV field name to class attribute name, computed once per class
+
+        By default, they are assumed to be the same unless specified by `selfCls._CUSTOM_CSV_FIELD_NAMES_MAP`
+        """
+        selfClsFields = tuple(attr.fields_dict(selfCls).keys())
+        assert all(f in selfClsFields for f in selfCls._CUSTOM_CSV_FIELD_NAMES_MAP.keys() ), '_CUSTOM_CSV_FIELD_NAMES_MAP has unknown keys!'
+        return MappingProxyType({ **{ f: f for f in selfClsFields },
+                                  **{ csv_field: cls_field for cls_field, csv_field in selfCls._CUSTOM_CSV_FIELD_NAMES_MAP.items() } })
     
     @abstractmethod
     # Return type to match with `csv._DictRow` (unable to import this type though)
@@ -63,19 +84,36 @@ class Record(ABC):
 
         return selfCls(**{csv_field_map[csv_field]: val for csv_field, val in row.items()})
 
+    @classmethod
+    def indexMap(selfCls, header: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+        """
+        Map each class attribute to its column index in rows following the given CSV header
+        """
+        csv_field_map = selfCls._get_csv_field_map()
+        return tuple((csv_field_map[csv_field], i) for i, csv_field in enumerate(header))
+
+    @classmethod
+    def fromRow(selfCls: Type["Record"], row: Sequence[str], idx: Iterable[Tuple[str, int]]) -> "Record":
+        """
+        Convert the raw csv string for one positional row into the corresponding Record object
+
+        `idx` is the result of `indexMap` for the header of the CSV file
+        """
+        return selfCls(**{attr_name: row[i] for attr_name, i in idx})
+
     
-@attr.s(auto_attribs=True, on_setattr=attr_on_setattr_convert_if_type_mismatch)
+@attr.s(auto_attribs=True, frozen=True, slots=True)
 class Patch(Record):
     RepoName: str
-    PRID: Optional[int] = attr.ib(converter=lambda x: None if x == 'null' else int(x))
-    IssueIDs: Optional[Iterable[int]] = attr.ib(converter=lambda x: tuple(int(y) for y in x.split(';') if y) if x!='null' else None)
-    Commits: Iterable[str] = attr.ib(converter=lambda x: tuple(y for y in x.split(';')))
+    PRID: Optional[int] = attr.ib(converter=convert_prid)
+    IssueIDs: Optional[Iterable[int]] = attr.ib(converter=convert_issue_ids)
+    Commits: Iterable[str] = attr.ib(converter=convert_semicolon_list)
     Merged: bool = attr.ib(converter=bool)
     ContractName: str
     FunctionName: str # Empty string for default function, "constructor" for constructor function
-    ContractFilePath: Path = attr.ib(converter=Path)
+    ContractFilePath: str = attr.ib(converter=str)
     Vulnerabilities: Dict[Tuple[str], Iterable[str]] = attr.ib(converter=convert_vuln)
-    
+
     # TODO
     def toDictWriterRow(self):
         row = {}
@@ -91,8 +129,17 @@ class Patch(Record):
 
         return row
 
+    @staticmethod
+    def formatted_row(RepoName: str, PRID: str, IssueIDs: str, Commits: str, Merged: str, ContractName: str,
+                      FunctionName: str, ContractFilePath: str, Vulnerabilities: str) -> List[str]:
+        """
+        Return a row object for `csv.writer` from fields already in their CSV form, without building a Patch
+        """
+        return [RepoName, PRID, IssueIDs or 'null', Commits, Merged, ContractName, FunctionName,
+                str(ContractFilePath), Vulnerabilities]
+
 
-@attr.s(auto_attribs=True, on_setattr=attr_on_setattr_convert_if_type_mismatch)
+@attr.s(auto_attribs=True, frozen=True, slots=True)
 class Contract(Record):
     _CUSTOM_CSV_FIELD_NAMES_MAP: ClassVar[Dict[str, str]] = { 
         'SOLC_Version': 'SOLC-Version',
@@ -100,11 +147,12 @@ class Contract(Record):
                                           
     RepoName: str
     ContractName: str
-    CommitHashes: Iterable[str] = attr.ib(converter=lambda x: tuple(y for y in x.split(';')))
-    ContractFilePath: Path = attr.ib(converter=Path)
+    CommitHashes: Iterable[str] = attr.ib(converter=convert_semicolon_list)
+    ContractFilePath: str = attr.ib(converter=str)
     DeploymentAddress: str
-    SOLC_Version: Iterable[str] = attr.ib(converter=lambda x: tuple(y for y in x.split(';')))
+    SOLC_Version: Iterable[str] = attr.ib(converter=convert_semicolon_list)
     Vulnerabilities: Dict[Tuple[str], Iterable[str]] = attr.ib(converter=convert_vuln)
+
     # TODO
     def toDictWriterRow(self):
         row = {}
@@ -119,7 +167,7 @@ class Contract(Record):
         return row
 
                                           
-@attr.s(auto_attribs=True, on_setattr=attr_on_setattr_convert_if_type_mismatch)
+@attr.s(auto_attribs=True, frozen=True, slots=True)
 class Repo(Record):
     _CUSTOM_CSV_FIELD_NAMES_MAP: ClassVar[Dict[str, str]] = { 
         'Stars': '#Stars',
@@ -145,29 +193,32 @@ class Repo(Record):
 
         return row
 
-@attr.s(auto_attribs=True, hash=False, eq=False)
+@attr.s(auto_attribs=True, hash=False, eq=False, frozen=True, slots=True)
 class Vulnerability:
     vuln_name: str
-    contract_file_path: Path = attr.ib(converter=Path)
+    contract_file_path: str = attr.ib(converter=str)
     contract_name: str
     function_name: str
-    line_num: Iterable[int] = attr.ib(converter=lambda x: tuple(int(y) for y in x.split(':')))
+    line_num: Iterable[int] = attr.ib(converter=convert_line_num)
     ast_node_path: str
     ast_node: Dict[str, Any]
+    # Canonical form of the identifying fields and its hash, computed once as vulnerabilities are kept in sets
+    _key: Tuple = attr.ib(init=False, repr=False)
+    _hash: int = attr.ib(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        key = (self.ast_node_path, _freeze(self.ast_node), self.contract_name, self.function_name, self.vuln_name)
+        object.__setattr__(self, '_key', key)
+        object.__setattr__(self, '_hash', hash(key))
 
     def __eq__(self, other):
-        return (self.ast_node_path == other.ast_node_path and
-                not DeepDiff(self.ast_node, other.ast_node, ignore_order=True) and
-                self.contract_name == other.contract_name and
-                self.function_name == other.function_name and
-                self.vuln_name == other.vuln_name)
+        if not isinstance(other, Vulnerability):
+            return NotImplemented
+        # the cached hashes reject most mismatches before the frozen AST nodes are compared
+        return self is other or (self._hash == other._hash and self._key == other._key)
 
     def __hash__(self):
-        return (hash(self.ast_node_path) ^
-                hash(json.dumps(self.ast_node, sort_keys=True)) ^
-                hash(self.contract_name) ^
-                hash(self.function_name) ^
-                hash(self.vuln_name))
+        return self._hash
 
 class DeploymentAddressDetails(Document):
     deployment_address = StringField(required=True, unique=True)
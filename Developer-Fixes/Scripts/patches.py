@@ -5,21 +5,23 @@ import os
 import logging
 import datetime
 import re
-import csv
-from pathlib import Path
+import io
+import functools
+import subprocess
 import asyncio
 import concurrent.futures
 import git
 from semantic_version import NpmSpec
 from bs4 import BeautifulSoup
 from typing import Dict, Iterable, Set, Tuple
-from csv_processor import read_csv, write_csv
+from csv_processor import iter_csv, read_csv, write_csv, CsvAppender
 from http_methods import make_request
 from detector_slither import execute_slither, parse_slither_output
 from detector_oyente import execute_oyente, parse_oyente_output
 from blacklist_repos import BLACKLIST_REPOS
 from objects import Vulnerability, Patch
 from sol_parser import parse_solc
+from utils import write_vulns
 
 GITHUB = 'https://github.com'
 FIELDS = ['RepoName', 'PRID', 'IssueIDs', 'Commits', 'Merged', 'ContractName',
@@ -28,26 +30,29 @@ HEADER = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 \
                          (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36',
           'Cookie': '',
           "Content-Type": "text/html; charset=utf-8"}
+# BeautifulSoup backend used for the GitHub pages
+HTML_PARSER = 'lxml'
+# Directories containing any of these names are skipped when listing the contract files of a repository
+SOL_EXCLUDE_DIRS = ('node_modules', 'mocks', 'test')
+# Oldest compiler version supported by the detectors
+REQUIRED_SOLC_VERSION = NpmSpec('>=0.4.19').clause.clauses[0]
 # Path to oyente.py
 OYENTE_PATH = ''
 # No. of processes to execute concurrently
 PROCESSES = ''
+# No. of detector runs executed concurrently by a process
+DETECTOR_WORKERS = 8
 
 
 def setup_logger(log_dir, filename, detector):
     # directory for detector
-    cwd = os.getcwd()
-    os.chdir(log_dir)
-    if not os.path.exists(detector):
-        os.mkdir(detector)
-    os.chdir(detector)
+    detector_dir = os.path.join(log_dir, detector)
+    os.makedirs(detector_dir, exist_ok=True)
 
     l = logging.getLogger(detector)
-    fileHandler = logging.FileHandler(filename)
+    fileHandler = logging.FileHandler(os.path.join(detector_dir, filename))
     l.setLevel(logging.DEBUG)
     l.addHandler(fileHandler)
-    # reset working dir
-    os.chdir(cwd)
 
 
 def clone_repo(full_name, path):
@@ -73,30 +78,55 @@ def clone_repo(full_name, path):
         return repo
 
 
-def get_commits(repo, branch):
+def get_commits(repo, branch, path=None):
     """Extract list of commits from a repository
 
     :param repo: Git object reference
     :param branch: Name of the branch for which commits are required
+    :param path: If given, only the commits changing this file are listed
     :return: List of commits sorted from newest towards oldest
     """
-    commits = repo.git.log('--pretty=%H', branch).split('\n')
-    return commits
+    args = ['--pretty=%H', branch]
+    if path:
+        args += ['--', path]
+    return repo.git.log(*args).splitlines()
+
 
+def get_changed_files(repo, branch):
+    """Extract the files changed by every commit of a branch with a single `git log`
 
+    :param repo: Git object reference
+    :param branch: Name of the branch
+    :return: Dictionary of commit hash as key and list of changed files as value, merge commits are compared to their first parent
+    """
+    changed_files = {}
+    files = None
+    # each commit starts with a NUL prefixed line holding its hash
+    for line in repo.git.log('-m', '--name-only', '--pretty=format:%x00%H', branch).split('\n'):
+        if line.startswith('\0'):
+            commit_hash = line[1:]
+            # only the first listing of a merge commit (against its first parent) is kept
+            files = None if commit_hash in changed_files else changed_files.setdefault(commit_hash, [])
+        elif line and files is not None:
+            files.append(line)
+    return changed_files
+
+
+@functools.lru_cache(maxsize=256)
 def get_solc_version(version_str):
     """Extract solidity version from semantic version format
 
+    Results are cached as a repository contains only a handful of distinct pragmas.
+
     :param version_str: solidity version is the semantic version format
     :return: raw solidity version of the file
     """
     if not version_str:
         return None  # version not found in file
     version_str = ' <'.join(version_str.split('<'))
-    required_version = [v for v in NpmSpec('>=0.4.19').clause.clauses]
     given_target = sorted(v.target for v in NpmSpec(version_str).clause.clauses)
     for t in given_target:
-        if required_version[0].match(t):
+        if REQUIRED_SOLC_VERSION.match(t):
             return str(t)
     return None  # Incompatible version
 
@@ -107,24 +137,22 @@ def check_lib(repo_path):
     :param repo_path: Absolute path to repository
     """
     # check package.json
-    cwd = os.getcwd()
-    os.chdir(repo_path)
-    if os.path.exists(f'{repo_path}/package.json'):
-        if not os.path.exists(repo_path + '/node_modules'):
-            # logging.info('Installing node modules for : ' + repo_path.split('/')[-1])
-            os.system('npm install')
-
-    os.chdir(cwd)
+    if os.path.exists(f'{repo_path}/package.json') and not os.path.exists(f'{repo_path}/node_modules'):
+        # logging.info('Installing node modules for : ' + repo_path.split('/')[-1])
+        # install scripts are not needed to get the solidity sources of the libraries
+        try:
+            subprocess.run(['npm', 'install', '--no-audit', '--no-fund', '--ignore-scripts'], cwd=repo_path,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            print(e)
 
 
 def get_sol_files(repo_path):
     sol_files = []
-    for path in Path(repo_path).rglob('*.sol'):
-        # remove parent directory & then skip node_modules, mock and test files
-        p = path.relative_to(repo_path)
-        if any(excludeDir in str(par) for par in p.parents for excludeDir in ('node_modules', 'mocks', 'test')):
-            continue
-        sol_files.append(str(path))
+    for root, dirs, files in os.walk(repo_path):
+        # skip node_modules, mock and test directories without walking them
+        dirs[:] = [d for d in dirs if not any(excludeDir in d for excludeDir in SOL_EXCLUDE_DIRS)]
+        sol_files.extend(os.path.join(root, f) for f in files if f.endswith('.sol'))
     return sol_files
 
 
@@ -138,9 +166,9 @@ def get_prid_mergestatus(full_name, commit_hash):
     prid = None
     try:
         response = make_request(f'{GITHUB}/{full_name}/branch_commits/{commit_hash}', HEADER)
-        parsed = BeautifulSoup(response.content, 'html.parser')
-        prid = parsed.find('li', class_='pull-request')
-        prid = prid.text.replace('(', '').replace(')', '').replace('#', '')
+        parsed = BeautifulSoup(response.content, HTML_PARSER)
+        prid = parsed.select_one('li.pull-request')
+        prid = prid.text.replace('(', '').replace(')', '').replace('#', '').strip()
         return (prid, 'True')
     except:
         return ('null', 'False')
@@ -157,14 +185,21 @@ def get_issueid(issues_path, prid):
     if prid == 'null':
         return 'null'
 
-    prid_ = '#' + prid
-    for f in Path(issues_path).rglob('*.txt'):
-        issue = open(f, 'r')
-        lines = issue.readlines()
-        issue_id = f.stem.split('_')[-1]
-        for line in lines:
-            if re.findall(prid_ + '\\D', line):
-                issue_ids.append(issue_id)
+    # reference to the PR, not followed by another digit
+    prid_re = re.compile(re.escape('#' + prid) + r'\D')
+    if not os.path.isdir(issues_path):
+        return ''
+    # issues of a repository are stored flat as REPONAME_ISSUEID.txt by `get_issues.py`
+    with os.scandir(issues_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt') or not entry.is_file():
+                continue
+            issue_id = entry.name[:-len('.txt')].split('_')[-1]
+            with open(entry.path, 'r', buffering=1 << 16) as issue:
+                for line in issue:
+                    if prid_re.search(line):
+                        issue_ids.append(issue_id)
+                        break
 
     issue_ids = ';'.join(issue_ids)
 
@@ -174,17 +209,35 @@ def get_issueid(issues_path, prid):
 def get_remappings(repo_path):
     """Extract library remapping required to compile a contract
 
+    The result is cached until node_modules is modified.
+
     :param repo_path: Absolute path to repository
     :return: Space separated string of remapping
     """
+    try:
+        mtime = os.stat(f'{repo_path}/node_modules').st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    return _get_remappings(repo_path, mtime)
+
+
+@functools.lru_cache(maxsize=64)
+def _get_remappings(repo_path, node_modules_mtime):
     remapping = ''
-    if os.path.exists(f'{repo_path}/node_modules'):
-        remapping = [f'{f.name}={f.path}' for f in os.scandir(f'{repo_path}/node_modules') if
-                     f.is_dir() and next(Path(f.path).rglob('*.sol'), False)]
-        remapping = ' '.join(remapping)
+    if node_modules_mtime is not None:
+        with os.scandir(f'{repo_path}/node_modules') as entries:
+            remapping = ' '.join(f'{f.name}={f.path}' for f in entries if f.is_dir() and _has_sol(f.path))
     return remapping
 
 
+def _has_sol(path):
+    """Check if a directory contains a solidity file, stopping at the first one found"""
+    for _, _, files in os.walk(path):
+        if any(f.endswith('.sol') for f in files):
+            return True
+    return False
+
+
 def get_vulnerabilities(repo_path, sol_files):
     """Extract vulnerabilities from given list of contract files
 
@@ -200,6 +253,7 @@ def get_vulnerabilities(repo_path, sol_files):
 
     remapping = get_remappings(repo_path)
 
+    jobs = []
     for sol_file in sol_files:
         # Parse solidity file
         ast, err = parse_solc(sol_file)
@@ -218,18 +272,31 @@ def get_vulnerabilities(repo_path, sol_files):
         version = get_solc_version(version_str)
         if not version:
             break  # Skip incompitable file
-        out_json = execute_slither(sol_file, version, remapping)
-        if out_json != 'null':
-            vulns['slither'] += parse_slither_output(out_json, ast, sol_file)
+        jobs.append((sol_file, ast, version))
+
+    if not jobs:
+        return vulns
+
+    # detectors spend their time in child processes, run them for all the files side by side
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(DETECTOR_WORKERS, 2 * len(jobs))) as detectors:
+        futures = [(sol_file, ast,
+                    detectors.submit(execute_slither, sol_file, version, remapping),
+                    detectors.submit(execute_oyente, OYENTE_PATH, sol_file, version, remapping))
+                   for sol_file, ast, version in jobs]
 
-        out_json = execute_oyente(OYENTE_PATH, sol_file, version, remapping)
-        if out_json != 'null':
-            vulns['oyente'] += parse_oyente_output(out_json, ast, sol_file)
+        for sol_file, ast, slither_future, oyente_future in futures:
+            out_json = slither_future.result()
+            if out_json != 'null':
+                vulns['slither'] += parse_slither_output(out_json, ast, sol_file)
+
+            out_json = oyente_future.result()
+            if out_json != 'null':
+                vulns['oyente'] += parse_oyente_output(out_json, ast, sol_file)
 
     return vulns
 
 
-def process_repo(full_name, log_dir, data_dir, patches_csv_path, issue_dir):
+def process_repo(full_name, log_dir, data_dir, patches_csv_path, issue_dir, done_path):
     """Process a repository to find patches.
 
     :param full_name: Full name of the repository
@@ -237,15 +304,14 @@ def process_repo(full_name, log_dir, data_dir, patches_csv_path, issue_dir):
     :param data_dir: Absolute path of location to store cloned repositories
     :param patches_csv_path: Absolute path of location to write results
     :param issue_dir: Absolute path of location which contains issues data
+    :param done_path: Absolute path of the file listing the processed repositories
     """
     print(f'processing repo : {full_name}')
 
-    # logfile for Slither
-    slither_logfile = full_name.replace('/', '__') + '_' + str(datetime.datetime.now()) + '.log'
-    setup_logger(log_dir, slither_logfile, 'slither')
-    # logfile for oyente
-    oyente_logfile = full_name.replace('/', '__') + '_' + str(datetime.datetime.now()) + '.log'
-    setup_logger(log_dir, oyente_logfile, 'oyente')
+    # logfile for Slither & oyente
+    logfile = full_name.replace('/', '__') + '_' + str(datetime.datetime.now()) + '.log'
+    setup_logger(log_dir, logfile, 'slither')
+    setup_logger(log_dir, logfile, 'oyente')
 
     if not os.path.exists(data_dir + '/' + full_name.replace('/', '__')):
         os.mkdir(data_dir + '/' + full_name.replace('/', '__'))
@@ -262,40 +328,39 @@ def process_repo(full_name, log_dir, data_dir, patches_csv_path, issue_dir):
     default_branch = repo.git.symbolic_ref('--short', 'HEAD')
 
     commit_hashes = get_commits(repo, branch=default_branch)
+    changed_files = get_changed_files(repo, default_branch)
 
     current_sol_files = get_sol_files(repo_path)
+    current_sol_files_set = set(current_sol_files)
 
     # Initially add all the vulns
     vulnerabilities = get_vulnerabilities(repo_path, current_sol_files)
     # set of all vulnerabilities
     total_vuln = set(v for vulns in vulnerabilities.values() for v in vulns)
 
+    # rows are written once all the commits are checked, a repository failing partway leaves no rows behind
+    patch_rows = []
     total_commits = []
     # check for patches
     for commit_hash in commit_hashes:
         total_commits.append(commit_hash)
         sol_files = []
-        # checkout commit
-        repo.git.checkout(commit_hash)
-
         # get list of files which are changed
-        files = repo.git.log('-m', '-1', '--name-only',
-                             commit_hash, pretty='format:').split('\n')
-        for f in files:
-            if f == '':
-                break
+        for f in changed_files.get(commit_hash, ()):
             # Keeping only .sol files
             # Ignoring mocks, tests & node_modules files
-            if not f.endswith('.sol') or 'node_modules' in f or 'mocks' in f or 'test' in f:
+            if not f.endswith('.sol') or any(excludeDir in f for excludeDir in SOL_EXCLUDE_DIRS):
                 continue
             sol_file = repo_path + '/' + f
             # using only those files which are a part of current state of repo
-            if sol_file in current_sol_files:
+            if sol_file in current_sol_files_set:
                 sol_files.append(sol_file)
 
-        # If no .sol files were changed
+        # If no .sol files were changed, the commit need not be checked out
         if not sol_files:
             continue
+        # checkout commit
+        repo.git.checkout(commit_hash)
 
         # dictionary of (function_name, contract_name) as Key and associated vulnerability as values
         new_vulns_slither: Dict[Tuple[str], Set[Vulnerability]] = {}
@@ -321,53 +386,62 @@ def process_repo(full_name, log_dir, data_dir, patches_csv_path, issue_dir):
         issues_path = issue_dir + full_name.replace('/', '__')
         issue_ids = get_issueid(issues_path, prid)
         total_commits = ';'.join(total_commits)
-        for function in functions_meta:
-            function_name = function[0]
-            contract_name = function[1]
-            # set of vulns found by slither, oyente or both
-            slither_vulns = set()
-            oyente_vulns = set()
-            common_vulns = set()
-            if (function_name, contract_name) in new_vulns_slither.keys() and (
-                    function_name, contract_name) in new_vulns_oyente.keys():
-                common_vulns = new_vulns_slither[(function_name, contract_name)].union(
-                    new_vulns_oyente[(function_name, contract_name)])
-            elif (function_name, contract_name) in new_vulns_slither.keys():
-                slither_vulns = new_vulns_slither[(function_name, contract_name)]
-            elif (function_name, contract_name) in new_vulns_oyente.keys():
-                oyente_vulns = new_vulns_oyente[(function_name, contract_name)]
-
-            vuln_col = []
-            if common_vulns:
-                vuln_col.append('Slither|Oyente:' + '|'.join(
-                    f'{v.vuln_name}(' + ':'.join([str(v) for v in v.line_num]) + ')' for v in common_vulns))
-
-            if slither_vulns:
-                vuln_col.append('Slither:' + '|'.join(
-                    f'{v.vuln_name}(' + ':'.join([str(v) for v in v.line_num]) + ')' for v in slither_vulns))
-
-            if oyente_vulns:
-                vuln_col.append('Oyente:' + '|'.join(
-                    f'{v.vuln_name}(' + ':'.join([str(v) for v in v.line_num]) + ')' for v in oyente_vulns))
-            vuln_col = ';'.join(vuln_col)
-
-            with open(patches_csv_path, 'a') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=FIELDS)
-                writer.writerow(Patch(
-                    full_name,
-                    prid,
-                    issue_ids,
-                    total_commits,
-                    merged_status,
-                    contract_name,
-                    function_name,
-                    function[2],  # contract_file_path
-                    vuln_col
-                ).toDictWriterRow())
+
+        # Vulnerabilities column of every (function_name, contract_name), listing vulns found by slither, oyente or both
+        vuln_cols = {}
+        for key in new_vulns_slither.keys() | new_vulns_oyente.keys():
+            slither_vulns = new_vulns_slither.get(key)
+            oyente_vulns = new_vulns_oyente.get(key)
+            vuln_col = io.StringIO()
+            if slither_vulns and oyente_vulns:
+                write_vulns(vuln_col, 'Slither|Oyente', slither_vulns | oyente_vulns)
+            elif slither_vulns:
+                write_vulns(vuln_col, 'Slither', slither_vulns)
+            else:
+                write_vulns(vuln_col, 'Oyente', oyente_vulns)
+            vuln_cols[key] = vuln_col.getvalue()
+
+        commit_rows = [Patch.formatted_row(
+            full_name,
+            prid,
+            issue_ids,
+            total_commits,
+            merged_status,
+            function[1],  # contract_name
+            function[0],  # function_name
+            function[2],  # contract_file_path
+            vuln_cols[(function[0], function[1])]
+        ) for function in functions_meta]
+        patch_rows.extend(commit_rows)
 
         # reset total commits
         total_commits = []
 
+    with CsvAppender(patches_csv_path) as patches_csv:
+        patches_csv.writerows(patch_rows)
+
+    # the results of the repository are written, mark it as processed
+    with open(done_path, 'a') as done_file:
+        done_file.write(full_name + '\n')
+
+
+def drop_unfinished_rows(patches_csv_path, done_repos):
+    """Remove the rows of repositories not marked as processed, left by a run that stopped partway
+
+    :param patches_csv_path: Absolute path to Patches.csv
+    :param done_repos: Set of the processed repositories
+    """
+    rows = read_csv(patches_csv_path)
+    kept = [row for row in rows if row and (row[0] == FIELDS[0] or row[0] in done_repos)]
+    if len(kept) == len(rows):
+        return
+    logging.info(f'Dropping {len(rows) - len(kept)} rows of unfinished repositories from Patches.csv')
+    tmp_path = patches_csv_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    write_csv(tmp_path, kept)
+    os.replace(tmp_path, patches_csv_path)
+
 
 async def fetch_patches():
     """This function setup loggers, reads input data from step 1, and spawns parallel processes for each repository.
@@ -390,7 +464,7 @@ async def fetch_patches():
 
     # path for patches.csv
     patches_csv_path = os.path.dirname(os.getcwd()) + '/Patches.csv'
-    write_csv(patches_csv_path, FIELDS)
+    write_csv(patches_csv_path, [FIELDS])
 
     # directory for storing repos
     data_dir = os.getcwd() + '/data'
@@ -401,7 +475,17 @@ async def fetch_patches():
     issue_dir = os.path.dirname(cwd) + '/IssuesData/'
 
     # get list of repos which are processed already
-    done_repos = {row[0] for row in read_csv(patches_csv_path)}
+    done_path = repo_csv_path + '/.patches_done'
+    if os.path.exists(done_path):
+        with open(done_path) as done_file:
+            done_repos = set(done_file.read().splitlines())
+        # these repos are processed again, their earlier rows would be duplicated
+        drop_unfinished_rows(patches_csv_path, done_repos)
+    else:
+        # results written before the list of processed repos was kept
+        done_repos = {row[0] for row in iter_csv(patches_csv_path)}
+        with open(done_path, 'w') as done_file:
+            done_file.writelines(full_name + '\n' for full_name in done_repos if full_name != FIELDS[0])
 
     # async tasks
     tasks = []
@@ -412,7 +496,7 @@ async def fetch_patches():
             if row[0] in BLACKLIST_REPOS or row[0] in done_repos:
                 continue
             tasks.append(loop.run_in_executor(pool, process_repo,
-                                              row[0], log_dir, data_dir, patches_csv_path, issue_dir))
+                                              row[0], log_dir, data_dir, patches_csv_path, issue_dir, done_path))
 
     await asyncio.wait(tasks)
 
@@ -1,148 +1,362 @@
 """
 Contains functions to collect fix repositories for finding patches
 """
-from http_methods import make_request
-from csv_processor import write_csv
-from bs4 import BeautifulSoup
+from http_methods import make_request, is_ok
+from csv_processor import write_csv, CsvAppender
 from solidity_parser import parser
 from math import ceil
+from urllib.parse import quote
 import os
+import re
 import semantic_version
-import git
 import subprocess
 import datetime
 import json
 import shutil
 import logging
+import concurrent.futures
+import queue
+import threading
+import uuid
 
 GITHUB = 'https://github.com'
+GITHUB_API = 'https://api.github.com'
+GITHUB_RAW = 'https://raw.githubusercontent.com'
 HEADER = {
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36',
     'Cookie': '',
     "Content-Type": "text/html; charset=utf-8"}
 API_HEADER = {'Accept': 'application/vnd.github.cloak-preview+json'}
+# Personal access token of the GitHub API, unauthenticated requests get a much lower rate limit
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+if GITHUB_TOKEN:
+    API_HEADER['Authorization'] = 'token ' + GITHUB_TOKEN
+
+# Version requirement of a solidity file, read before falling back to the solidity parser
+PRAGMA_RE = re.compile(rb'\bpragma\s+solidity\s+([^;]+);')
+# Comments (blanked before searching for the pragma) and string literals (kept, they may contain `//`)
+COMMENT_RE = re.compile(rb'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')|//[^\n]*|/\*.*?(?:\*/|\Z)', re.DOTALL)
+# Minimum compiler version of a fix repository
+MIN_VER = semantic_version.Version('0.4.19')
+# Spec of the compiler versions of a fix repository, matched against version requirements that are not plain versions
+REQ_SOL_VER = semantic_version.SimpleSpec('>=0.4.19')
+# No. of bytes at the start of a local solidity file searched for its pragma
+PRAGMA_SCAN_BYTES = 8192
+# Repositories with more solidity files than this are cloned instead of downloading the files one by one
+MAX_REMOTE_SOL_FILES = 20
+# File next to Repos.csv keeping the results of inspected repositories across runs
+REPOS_CACHE_FILE = 'repos_cache.json'
+# No. of accepted repositories buffered before they are written to Repos.csv
+REPOS_FLUSH_EVERY = 32
+# No. of repositories of a page checked concurrently, requests are still spaced by the budget of `make_request`
+REPO_WORKERS = 8
+# No. of search results between two progress lines in the logs
+REPO_PROGRESS_EVERY = 100
+
+# Cloned repositories waiting to be deleted by the background worker
+_rm_queue = queue.Queue()
 
 fields = ['RepoName', '#Stars', '#Watchers', 'InspectionTime', 'LastActivityTime', '#ContractFiles']
-repo_count = 0
-start_count = 49
 
 
 def clone_repo(url, path):
-    """The function clones a repository locally. If already exists, reset its head to master
+    """The function clones the .sol files of a repository locally, unless already cloned
 
     :param url: GitHub URL of the repository
     :param path: Absolute path to storage location
     :return: True if cloned successfully else False
     """
     repo_name = url.split('/')[-1]
-    if not os.path.exists(path + '/' + repo_name):
+    repo_path = path + '/' + repo_name
+    if not os.path.exists(repo_path):
         try:
-            git.Git(path).clone(url)
+            # only the latest snapshot of the .sol files is needed, skip the history and all other blobs
+            subprocess.run(['git', 'clone', '--depth=1', '--filter=blob:none', '--no-checkout', url],
+                           cwd=path, check=True, capture_output=True)
+            # if sparse checkout is not supported by git, the checkout below falls back to all the files
+            subprocess.run(['git', '-C', repo_path, 'sparse-checkout', 'set', '--no-cone', '*.sol'],
+                           capture_output=True)
+            subprocess.run(['git', '-C', repo_path, 'checkout'], check=True, capture_output=True)
         except Exception as e:
             logging.exception(e)
             return False
     return True
 
 
-def get_sol_files(path):
-    """Extract list of all solidity files in a repository
+def _rm_worker():
+    while True:
+        repo_path = _rm_queue.get()
+        shutil.rmtree(repo_path, ignore_errors=True)
+        _rm_queue.task_done()
+
+
+threading.Thread(target=_rm_worker, daemon=True).start()
+
+
+def remove_clone(repo_path):
+    """Delete a cloned repository in the background, `wait_for_removals` waits for the pending ones
+
+    :param repo_path: Absolute path to the cloned repository
+    """
+    # moved aside first, so that the repository can be cloned again at once
+    trash_path = f'{repo_path}.{uuid.uuid4().hex}.rm'
+    try:
+        os.rename(repo_path, trash_path)
+    except OSError:
+        trash_path = repo_path
+    _rm_queue.put(trash_path)
+
+
+def wait_for_removals():
+    _rm_queue.join()
+
+
+def iter_sol_files(path):
+    """Lazily list all solidity files in a repository
 
     :param path: Absolute path to the repository
-    :return: List of all solidity file paths
+    :return: Generator of solidity file paths
+    """
+    dirs = [path]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                # file types come from the directory listing, symlinks are skipped as `find -type f` does
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != '.git':
+                        dirs.append(entry.path)
+                elif entry.name.endswith('.sol') and entry.is_file(follow_symlinks=False):
+                    yield entry.path
+
+
+def match_pragma_version(source):
+    """Extract the solidity version requirement from the source of a file without parsing it
+
+    :param source: Source of the solidity file (bytes)
+    :return: Version requirement in the format of the pragma directive of the AST, None if not found
+    """
+    # a commented out pragma is not in the AST either
+    match = PRAGMA_RE.search(COMMENT_RE.sub(lambda m: m.group(1) or b' ', source))
+    if not match:
+        return None
+    # the AST joins the tokens of the requirement without whitespace
+    return ''.join(match.group(1).decode('utf-8', 'replace').split())
+
+
+def get_pragma_version(parsed):
+    """Extract the version requirement of a parsed solidity file
+
+    :param parsed: AST of the solidity file
+    :return: Value of the first pragma directive, None if not found
     """
-    proc = subprocess.Popen(['find', path, '-type', 'f', '-name', '*.sol'], stdout=subprocess.PIPE)
-    (out, _) = proc.communicate()
-    all_files = out.decode("utf-8").split('\n')[:-1]
-    return all_files
+    for child in parsed['children']:
+        if child['type'] == 'PragmaDirective':
+            return child['value']
+    # ver = parsed['children'][0]['value'].replace('^','')
+    return None
 
 
-def check_solidity_version(url):
+def is_fix_version(ver):
+    """Check if a version requirement allows a compiler version >=0.4.19
+
+    :param ver: Version requirement of a solidity file
+    :return: True if the version is supported else False
+    """
+    # drop the caret and any upper bound
+    ver = ver.split('<', 1)[0].replace('^', '')
+    try:
+        # a plain version is compared directly, specs like `>=0.4.0` are parsed below
+        file_ver = semantic_version.Version(ver)
+    except ValueError:
+        file_ver = None
+    # prereleases are left to the spec, which handles them differently from a plain comparison
+    if file_ver is not None and not file_ver.prerelease:
+        return file_ver >= MIN_VER
+    file_sol_ver = semantic_version.SimpleSpec(ver)
+
+    # checking if version >= 0.4.19
+    return REQ_SOL_VER.match(file_sol_ver.clause.target)
+
+
+def list_sol_paths(full_name, branch):
+    """List the solidity files of a repository with the GitHub tree API
+
+    :param full_name: Full name of the repository
+    :param branch: Branch to list
+    :return: List of solidity file paths, None if the tree could not be listed completely
+    """
+    response = make_request(f'{GITHUB_API}/repos/{full_name}/git/trees/{quote(branch)}?recursive=1', API_HEADER)
+    if not is_ok(response):
+        return None
+    tree = json.loads(response.content)
+    if tree.get('truncated'):
+        return None
+    # symlinks are skipped, as `find -type f` does on a clone
+    return [entry['path'] for entry in tree['tree']
+            if entry['type'] == 'blob' and entry['mode'] != '120000' and entry['path'].endswith('.sol')]
+
+
+def check_solidity_version_remote(full_name, branch, sol_paths):
+    """Check the pragma of solidity files of a repository by downloading only those files
+
+    :param full_name: Full name of the repository
+    :param branch: Branch to read the files from
+    :param sol_paths: Paths of the solidity files in the repository
+    :return: True if repository is a fix repo, None if not found but some files could not be fetched, else False
+    """
+    failed = False
+    for sol_path in sol_paths:
+        try:
+            response = make_request(f'{GITHUB_RAW}/{full_name}/{quote(branch)}/{quote(sol_path)}', HEADER)
+            if not is_ok(response):
+                logging.error('Unable to fetch file ' + sol_path)
+                failed = True
+                continue
+            ver = match_pragma_version(response.content) or \
+                get_pragma_version(parser.parse(response.content.decode('utf-8')))
+            if not ver:
+                logging.error('File version not found in file ' + sol_path)
+                continue
+            if is_fix_version(ver):
+                return True
+        except Exception as e:
+            logging.exception(e)
+            continue
+    return None if failed else False
+
+
+def check_solidity_version(url, default_branch=None):
     """Check if a repository is a fix repository by checking if it contains atleast one file with version >=0.4.19
 
+    The solidity files are listed and downloaded through the GitHub API when there are only a few of them,
+    otherwise the repository is cloned.
+
     :param url: URL of repository
-    :return: True if repository is a fix repo else False
+    :param default_branch: Default branch of the repository, if known
+    :return: (True if repository is a fix repo, None if it could not be inspected, else False, count of solidity files)
     """
-    # clone repo
-    path = os.getcwd() + '/data'
-    if not os.path.exists(path):
-        os.mkdir('data')
-
-    # check if repo has .sol files or not
-    response = make_request(url + '/search?q=extension%3Asol', HEADER)
-    parsed = BeautifulSoup(response.content, 'html.parser')
-    try:
-        parsed.find('div', class_='code-list').find('a')['href']
-    except Exception as e:
-        logging.exception(e)
-        logging.info('Does not contains .sol files')
-        return False, '0'
+    full_name = '/'.join(url.split('/')[-2:])
+    sol_paths = list_sol_paths(full_name, default_branch) if default_branch else None
+    if sol_paths is not None and len(sol_paths) <= MAX_REMOTE_SOL_FILES:
+        status = check_solidity_version_remote(full_name, default_branch, sol_paths)
+        if status:
+            return True, len(sol_paths)
+        if status is not None:
+            return False, '0'
+        # some files could not be downloaded, check a clone instead
+
+    # clone repo, under the directory of its owner as repos are cloned concurrently
+    path = os.path.join(os.getcwd(), 'data', url.split('/')[-2])
+    os.makedirs(path, exist_ok=True)
 
     if not clone_repo(url, path):
-        return False, '0'
+        return None, '0'
 
-    sol_files = get_sol_files(path + '/' + url.split('/')[-1])
+    # files are only listed until the first fix file is found
+    sol_files = iter_sol_files(path + '/' + url.split('/')[-1])
 
-    for sol_file in sol_files:
+    for file_count, sol_file in enumerate(sol_files, 1):
         try:
-            parsed = parser.parse_file(sol_file)
-            ver = None
-            for child in parsed['children']:
-                if child['type'] == 'PragmaDirective':
-                    ver = child['value']
-                    break
-            # ver = parsed['children'][0]['value'].replace('^','')
-
+            with open(sol_file, 'rb') as f:
+                ver = match_pragma_version(f.read(PRAGMA_SCAN_BYTES))
+            if not ver:
+                ver = get_pragma_version(parser.parse_file(sol_file))
             if not ver:
                 logging.error('File version not found in file ' + str(sol_file))
                 continue
 
-            ver = ver.replace('^', '')
-            if '<' in ver:
-                ver = ver.split('<')[0]
-            file_sol_ver = semantic_version.SimpleSpec(ver)
-
-            # checking if version >= 0.4.19
-            req_sol_ver = semantic_version.SimpleSpec('>=0.4.19')
-            if req_sol_ver.match(file_sol_ver.clause.target):
-                shutil.rmtree(path + '/' + url.split('/')[-1])
-                return True, len(sol_files)
+            if is_fix_version(ver):
+                # count the rest of the files
+                file_count += sum(1 for _ in sol_files)
+                remove_clone(path + '/' + url.split('/')[-1])
+                return True, file_count
 
         except Exception as e:
             logging.exception(e)
             continue
 
     # delete cloned copy of repo
-    shutil.rmtree(path + '/' + url.split('/')[-1])
+    remove_clone(path + '/' + url.split('/')[-1])
     return False, '0'
 
 
-def fetch_watchers(url):
-    """Extract the number of watchers on a repository
+def fetch_watchers(full_name):
+    """Fetch the number of watchers on a repository
+
+    :param full_name: Full name of the repository
+    :return: Number of watchers, None if it could not be fetched
+    """
+    response = make_request(f'{GITHUB_API}/repos/{full_name}', API_HEADER)
+    if not is_ok(response):
+        logging.error('Unable to fetch the watchers of ' + full_name)
+        return None
+    # `watchers_count` of the API is the number of stars, watchers are the subscribers
+    return json.loads(response.content)['subscribers_count']
+
+
+def inspect_repo(item):
+    """Check if a repo of the search results is a fix repository, If yes, fetch its watchers
 
-    :param url: GitHub url of the repository
-    :return: Number of watches
+    :param item: Repository entry of the GitHub API search results
+    :return: [Fix repository status, count of solidity files, watchers], None if the repo could not be inspected
     """
-    response = make_request(url, HEADER)
-    parsed = BeautifulSoup(response.content, 'html.parser')
-    watcher_count = parsed.find('a', class_='social-count').text
+    (status, file_count) = check_solidity_version(item['html_url'], item.get('default_branch'))
+    # failed requests or clones are not a result, the repo is inspected again in the next run
+    if status is None:
+        return None
+    if not status:
+        return [False, file_count, None]
+    watchers = fetch_watchers(item['full_name'])
+    if watchers is None:
+        return None
+    return [True, file_count, watchers]
+
 
-    watcher_count = watcher_count.split('\n')[1].strip()
-    return watcher_count
+def get_cache_key(item):
+    # a repository is inspected again once it is pushed to
+    return f"{item['full_name']}@{item.get('pushed_at')}"
 
 
-def repo_details(json_response):
+def load_repos_cache(cache_path):
+    """Load the results of the repositories inspected in earlier runs
+
+    :param cache_path: Absolute path to the cache file
+    :return: Dictionary of `get_cache_key` as key and result of `inspect_repo` as value
+    """
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_repos_cache(cache_path, cache):
+    """Save the inspected repositories, replacing the cache file atomically
+
+    :param cache_path: Absolute path to the cache file
+    :param cache: Dictionary from `load_repos_cache`
+    """
+    with open(cache_path + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(cache_path + '.tmp', cache_path)
+
+
+def repo_details(json_response, repos_csv, cache, state):
     """Check if repo is a fix repository, If yes, extract its metadata
 
     :param json_response: Parsed HTTP response of the GitHub API containing list of possible fix repos
+    :param repos_csv: `CsvAppender` of Repos.csv
+    :param cache: Results of the repositories inspected already, updated with the repos of the page
+    :param state: Dictionary with the count of search results seen so far and the count to start from, updated
     """
-    global repo_count
-    global start_count
-
+    items = []
     for item in json_response['items']:
         # for debugging...
-        repo_count += 1
-        print('--------------Repo Count-------------->  ' + str(repo_count))
-        if repo_count < start_count:
+        state['count'] += 1
+        logging.debug('Repo count : %d', state['count'])
+        if state['count'] % REPO_PROGRESS_EVERY == 0:
+            logging.info('Repos processed : %d', state['count'])
+        if state['count'] < state['start']:
             continue
 
         # ------------------------------------------------------------------------
@@ -160,38 +374,78 @@ def repo_details(json_response):
         #         continue
         # ------------------------------------------------------------------------
 
+        items.append(item)
+
+    # repos are checked concurrently, skipping those inspected already
+    pending = [item for item in items if get_cache_key(item) not in cache]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=REPO_WORKERS) as pool:
+        futures = {pool.submit(inspect_repo, item): item for item in pending}
+        for future in concurrent.futures.as_completed(futures):
+            item = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # a failing repo only loses its own result
+                logging.exception(e)
+                continue
+            # repos without a result are not cached, they are inspected again in the next run
+            if result is not None:
+                cache[get_cache_key(item)] = result
+
+    # rows are written in the order of the search results
+    for item in items:
+        result = cache.get(get_cache_key(item))
+        if result is None:
+            logging.error('Repo skipped, inspection failed : ' + str(item['full_name']))
+            continue
+        (status, file_count, watchers) = result
+        if not status:
+            continue
         row = []
-        (status, file_count) = check_solidity_version(item['html_url'])
-        if status:
-            # Full name of the repo
-            row.append(item['full_name'])
-            # Stars on the repo
-            row.append(item['stargazers_count'])
-            # watchers on the repo
-            watchers = fetch_watchers(item['html_url'])
-            row.append(watchers)
-            # Inspection time
-            row.append(str(datetime.datetime.now()))
-            # Last update time
-            row.append(item['updated_at'])
-            # Count of Solidity files
-            row.append(file_count)
-            write_csv(os.path.dirname(os.getcwd()) + '/Repos.csv', row)
-            logging.info('Repo added : ' + str(item['full_name']))
-
-
-def fetch_repo_list():
+        # Full name of the repo
+        row.append(item['full_name'])
+        # Stars on the repo
+        row.append(item['stargazers_count'])
+        # watchers on the repo
+        row.append(watchers)
+        # Inspection time
+        row.append(str(datetime.datetime.now()))
+        # Last update time
+        row.append(item['updated_at'])
+        # Count of Solidity files
+        row.append(file_count)
+        repos_csv.writerow(row)
+        logging.info('Repo added : ' + str(item['full_name']))
+
+    # write the repos of the page
+    repos_csv.flush()
+
+
+def fetch_repo_list(repos_csv, cache_path, start=0):
+    """Process all pages of the GitHub search for possible fix repositories
+
+    :param repos_csv: `CsvAppender` of Repos.csv
+    :param cache_path: Absolute path to the cache of inspected repositories, saved after every page
+    :param start: Position of the first search result to process, earlier ones are skipped (for debugging)
+    """
+    state = {'count': 0, 'start': start}
+    cache = load_repos_cache(cache_path)
+
     # github api request to fetch all repo with keyword:'smart contract' and stars:>9
     url = 'https://api.github.com/search/repositories?q=smart%20contract+stars:%3E9&per_page=100'
 
     response = make_request(url, API_HEADER)
+    if not is_ok(response):
+        logging.error('Unable to fetch the search results : ' + url)
+        return
     json_response = json.loads(response.content)
 
     total_repo_count = int(json_response['total_count'])
     pages = ceil(total_repo_count / 100)
 
     # process response from first page
-    repo_details(json_response)
+    repo_details(json_response, repos_csv, cache, state)
+    save_repos_cache(cache_path, cache)
 
     # process response from rest of pages
     while pages > 1:
@@ -203,19 +457,20 @@ def fetch_repo_list():
             continue
 
         response = make_request(nextpage_url, API_HEADER)
+        if not is_ok(response):
+            # the links to the following pages come with the response
+            logging.error('Unable to fetch the search results : ' + nextpage_url)
+            break
         json_response = json.loads(response.content)
-        repo_details(json_response)
+        repo_details(json_response, repos_csv, cache, state)
+        save_repos_cache(cache_path, cache)
         pages -= 1
 
 
 def fetch_repo_details():
-    # for debugging
-    global repo_count
-    global start_count
-    start_count = 0
-    repo_count = 0
-
     # csv file location
     path = os.path.dirname(os.getcwd())
-    write_csv(path + '/Repos.csv', fields)
-    fetch_repo_list()
+    write_csv(path + '/Repos.csv', [fields])
+    with CsvAppender(path + '/Repos.csv', batch_size=REPOS_FLUSH_EVERY) as repos_csv:
+        fetch_repo_list(repos_csv, path + '/' + REPOS_CACHE_FILE)
+    wait_for_removals()
@@ -1,8 +1,21 @@
 """
 Contains methods to parse solidity files and generate information from AST nodes
 """
+import os
+import functools
+import hashlib
 import subprocess
-import json
+import tempfile
+from bisect import bisect_right
+
+try:
+    # ASTs of real contracts are several MB of JSON, orjson parses them a few times faster
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Directory of the ASTs stored by the hash of the parsed file content
+AST_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'devfixes', 'ast')
 
 
 def get_attr(source, key):
@@ -13,48 +26,159 @@ def get_attr(source, key):
 
 
 def parse_solc(filepath):
+    """Parse a solidity file into its AST
+
+    Results are cached on the path, modification time and size of the file, as the same
+    unchanged files are parsed again at every commit.
+
+    :param filepath: Path to solidity file
+    :return: (AST, None) on success otherwise (None, error)
+    """
     try:
-        proc = subprocess.run(["solidity_parser", filepath], capture_output=True, text=True, check=True)
-        out = proc.stdout
-    except Exception as e:
-        return None, e.stderr
-    return json.loads(out), None
+        stat = os.stat(filepath)
+    except OSError:
+        return _parse_solc(filepath)
+    return _parse_solc_cached(filepath, stat.st_mtime_ns, stat.st_size)
 
 
-def get_node_from_line(data, lines):
-    lines = lines.split(':')
-    children = get_attr(data, 'children')
-    if not children:
+@functools.lru_cache(maxsize=128)
+def _parse_solc_cached(filepath, mtime_ns, size):
+    return _parse_solc(filepath)
+
+
+def _parse_solc(filepath):
+    # ASTs are also stored on disk by the hash of the file content, the same content shows up
+    # at many commits of a repository and in the temporary copies of blobs
+    cache_file = None
+    try:
+        with open(filepath, 'rb') as f:
+            cache_file = os.path.join(AST_CACHE_DIR, hashlib.blake2b(f.read(), digest_size=16).hexdigest() + '.json')
+        with open(cache_file, 'rb') as f:
+            return json_loads(f.read()), None
+    except (OSError, ValueError):
+        # not stored yet (or a corrupted entry, which is replaced)
+        pass
+
+    out, tmp_file = _open_output(cache_file)
+    try:
+        with out:
+            # the output goes from solidity_parser straight to the file and is read back in a single buffer,
+            # rather than collected from the pipe chunk by chunk and joined
+            try:
+                proc = subprocess.run(["solidity_parser", filepath], stdout=out, stderr=subprocess.PIPE)
+            except OSError as e:
+                return None, str(e)
+            if proc.returncode:
+                return None, proc.stderr.decode('utf-8', 'replace')
+            out.seek(0)
+            ast = json_loads(out.read())
+        if tmp_file:
+            try:
+                # concurrent processes may store the same entry, replace it atomically
+                os.replace(tmp_file, cache_file)
+                tmp_file = None
+            except OSError:
+                pass
+    finally:
+        if tmp_file:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+    return ast, None
+
+
+def _open_output(cache_file):
+    """Open the file receiving the AST printed by solidity_parser
+
+    :param cache_file: Path of the cache entry of the parsed file, None if unknown
+    :return: (file, path of the temporary file of the cache entry) or (anonymous file, None) if not stored
+    """
+    if cache_file:
+        try:
+            os.makedirs(AST_CACHE_DIR, exist_ok=True)
+            tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+            return open(tmp_file, 'w+b'), tmp_file
+        except OSError:
+            pass
+    return tempfile.TemporaryFile(), None
+
+
+def build_line_index(data):
+    """Index the subnodes of the top level nodes of an AST by their line range
+
+    :param data: AST of the solidity file
+    :return: (sorted start lines, list of (start line, end line, child start line, child end line, position, type, name)
+             sorted by start line, position being the (child, subnode) indices in the AST)
+    """
+    subNodes = sorted(((subNode['loc']['start']['line'], subNode['loc']['end']['line'],
+                        child['loc']['start']['line'], child['loc']['end']['line'],
+                        (i, j), subNode['type'], get_attr(subNode, 'name'))
+                       for i, child in enumerate(get_attr(data, 'children') or ())
+                       for j, subNode in enumerate(get_attr(child, 'subNodes') or ())),
+                      key=lambda subNode: subNode[0])
+    return [subNode[0] for subNode in subNodes], subNodes
+
+
+def find_node_from_line(line_index, lines):
+    """Find the subnode containing one of the given lines using an index from `build_line_index`
+
+    :param line_index: Line index of the solidity file
+    :param lines: Colon separated line numbers
+    :return: (type, name) of the subnode, the first one in AST order like a linear scan, ('', '') if not found
+             (name is None for unnamed subnodes such as state variable declarations)
+    """
+    starts, subNodes = line_index
+    found = None
+    for k, line in enumerate(int(line) for line in lines.split(':')):
+        i = bisect_right(starts, line) - 1
+        # subnodes do not nest, walk back over the ones sharing a line with the matched one
+        while i >= 0 and subNodes[i][1] >= line:
+            start, end, childStart, childEnd, (child, subNode), node_type, node_name = subNodes[i]
+            if childStart <= line <= childEnd:
+                key = (child, k, subNode)
+                if found is None or key < found[0]:
+                    found = (key, node_type, node_name)
+            i -= 1
+    if found is None:
         return '', ''
-    for child in children:
-        start = child['loc']['start']['line']
-        end = child['loc']['end']['line']
-        for line in lines:
-            if start <= int(line) <= end:
-                for subNode in get_attr(child, 'subNodes'):
-                    subNodeStart = subNode['loc']['start']['line']
-                    subNodeEnd = subNode['loc']['end']['line']
-                    if subNodeStart <= int(line) <= subNodeEnd:
-                        return subNode['type'], subNode['name']
+    return found[1], found[2]
 
-    return '', ''
 
+def build_node_index(data):
+    """Index the line range of the subnodes of the top level nodes of an AST by their type and name
 
-def get_lines_from_node(data, node_type, node_name):
-    lines = ''
-    if not get_attr(data, 'children'):
-        return lines
-    for child in get_attr(data, 'children'):
-        if not child.get('subNodes'):
-            continue
-        for subNode in get_attr(child, 'subNodes'):
-            if get_attr(subNode, 'type') == node_type and get_attr(subNode, 'name') == node_name:
-                subNodeStart = subNode['loc']['start']['line']
-                subNodeEnd = subNode['loc']['end']['line']
-                lines = ':'.join([str(line) for line in range(subNodeStart, subNodeEnd + 1)])
-                return lines
+    :param data: AST of the solidity file
+    :return: Dictionary of (type, name) as key and (start line, end line) of the first such subnode as value
+    """
+    node_index = {}
+    for child in get_attr(data, 'children') or ():
+        for subNode in get_attr(child, 'subNodes') or ():
+            node_index.setdefault((get_attr(subNode, 'type'), get_attr(subNode, 'name')),
+                                  (subNode['loc']['start']['line'], subNode['loc']['end']['line']))
+    return node_index
 
-    return lines
+
+def find_lines_from_node(node_index, node_type, node_name):
+    """Find the lines of a subnode using an index from `build_node_index`
+
+    :param node_index: Node index of the solidity file
+    :param node_type: Type of the subnode
+    :param node_name: Name of the subnode
+    :return: Colon separated line numbers of the subnode, empty if not found
+    """
+    lines = node_index.get((node_type, node_name))
+    if not lines:
+        return ''
+    return ':'.join(map(str, range(lines[0], lines[1] + 1)))
+
+
+def get_node_from_line(data, lines):
+    return find_node_from_line(build_line_index(data), lines)
+
+
+def get_lines_from_node(data, node_type, node_name):
+    return find_lines_from_node(build_node_index(data), node_type, node_name)
 
 
 def get_oline_from_mline(targetfile, mergedfile, mlines):
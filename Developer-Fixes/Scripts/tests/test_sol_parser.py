@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sol_parser import get_node_from_line, get_lines_from_node
+
+
+def loc(start, end):
+    return {'start': {'line': start}, 'end': {'line': end}}
+
+
+# solidity_parser emits state variable declarations and using-for directives without a `name`
+AST = {'type': 'SourceUnit', 'children': [
+    {'type': 'PragmaDirective', 'name': 'solidity', 'value': '^0.4.24', 'loc': loc(1, 1)},
+    {'type': 'ContractDefinition', 'name': 'A', 'loc': loc(3, 12), 'subNodes': [
+        {'type': 'UsingForDeclaration', 'loc': loc(4, 4)},
+        {'type': 'StateVariableDeclaration', 'loc': loc(5, 5)},
+        {'type': 'FunctionDefinition', 'name': 'f', 'loc': loc(7, 11)},
+    ]},
+]}
+
+
+class GetNodeFromLineTest(unittest.TestCase):
+
+    def test_unnamed_subnode_before_function(self):
+        self.assertEqual(get_node_from_line(AST, '8'), ('FunctionDefinition', 'f'))
+
+    def test_unnamed_subnode_matched(self):
+        self.assertEqual(get_node_from_line(AST, '5'), ('StateVariableDeclaration', None))
+
+    def test_line_outside_subnodes(self):
+        self.assertEqual(get_node_from_line(AST, '2:6'), ('', ''))
+
+    def test_lines_from_node(self):
+        self.assertEqual(get_lines_from_node(AST, 'FunctionDefinition', 'f'), '7:8:9:10:11')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 from typing import Optional, Dict, Any
+from bisect import bisect_right
 
 
 def get_attr(source: Optional[Dict[Any, Any]], key: Any):
@@ -8,35 +9,132 @@ def get_attr(source: Optional[Dict[Any, Any]], key: Any):
         return None
 
 
+def build_function_index(ast):
+    """Index the function definitions of an AST by their line range
+
+    :param ast: AST of the contract file
+    :return: (sorted start lines, sorted list of (start line, end line, function name))
+    """
+    functions = sorted(((subNode['loc']['start']['line'], subNode['loc']['end']['line'], subNode['name'])
+                        for child in ast['children'] if get_attr(child, 'subNodes')
+                        for subNode in child['subNodes'] if subNode['type'] == 'FunctionDefinition'),
+                       key=lambda function: function[0])
+    return [function[0] for function in functions], functions
+
+
+def find_function(function_index, line):
+    """Find the function to which a line of code belongs using an index from `build_function_index`
+
+    :param function_index: Function index of the contract file
+    :param line: line number
+    :return: Name of the function (if found otherwise None)
+    """
+    starts, functions = function_index
+    i = bisect_right(starts, line) - 1
+    name = None
+    # Functions do not nest, so the end lines are sorted too. Walk back over the functions
+    # sharing a line with the matched one to return the first defined, like a linear scan.
+    while i >= 0 and functions[i][1] >= line:
+        name = functions[i][2]
+        i -= 1
+    return name
+
+
+def write_vulns(buf, detectors, vulns):
+    """Write an entry `DETECTORS:VULS` of the `Vulnerabilities` column, e.g. `Slither:reentrancy-eth(25:26)`
+
+    :param buf: StringIO holding the column, entries are separated by `;`
+    :param detectors: Vertical bar separated list of detectors
+    :param vulns: Vulnerability objects found by the detectors
+    """
+    if buf.tell():
+        buf.write(';')
+    buf.write(detectors)
+    buf.write(':')
+    first = True
+    for v in vulns:
+        if not first:
+            buf.write('|')
+        first = False
+        buf.write(v.vuln_name)
+        buf.write('(')
+        buf.write(':'.join(map(str, v.line_num)))
+        buf.write(')')
+
+
 def remove_loc_info(d):
+    """Copy a json object without the `loc` entries of its dicts
+
+    The object is copied rather than stripped in place as ASTs are shared through the cache of `parse_solc`.
+    Nested containers are copied from an explicit stack instead of one recursive call per node.
+
+    :param d: Json object
+    :return: Copy of the object without `loc` entries
+    """
     if not isinstance(d, (dict, list)):
         return d
-    if isinstance(d, list):
-        return [remove_loc_info(v) for v in d]
-    else:
-        return {k: remove_loc_info(v) for k, v in d.items()
-                if k not in {'loc'}}
+    copy = {} if isinstance(d, dict) else []
+    stack = [(d, copy)]
+    while stack:
+        src, dst = stack.pop()
+        if isinstance(src, dict):
+            for k, v in src.items():
+                if k == 'loc':
+                    continue
+                if isinstance(v, (dict, list)):
+                    dst[k] = {} if isinstance(v, dict) else []
+                    stack.append((v, dst[k]))
+                else:
+                    dst[k] = v
+        else:
+            for v in src:
+                if isinstance(v, (dict, list)):
+                    dst.append({} if isinstance(v, dict) else [])
+                    stack.append((v, dst[-1]))
+                else:
+                    dst.append(v)
+    return copy
 
 
-def get_node_and_node_path(node, line):
-    node_path = ['children', '[*]']  # Ignoring indices & marking them as *
-    for child in node['children']:
+def build_node_index(ast):
+    """Index the AST nodes reported for vulnerabilities by their start line, in a single pass over the AST
+
+    :param ast: AST of the contract file
+    :return: Dictionary of start line as key and (AST node, node path) of the first node on the line as value
+    """
+    node_index = {}
+    node_path = ('children', '[*]')  # Ignoring indices & marking them as *
+    for child in ast['children']:
         if child['type'] == 'ContractDefinition':
-            node_path.extend(['subNodes', '[*]'])  # Ignoring indices & marking them as *
+            node_path += ('subNodes', '[*]')  # Ignoring indices & marking them as *
             for subNode in child['subNodes']:
                 if subNode['type'] in ('StateVariableDeclaration', 'UsingForDeclaration', 'EventDefinition'):
-                    if subNode['loc']['start']['line'] == line:
-                        return remove_loc_info(subNode), node_path
+                    node_index.setdefault(subNode['loc']['start']['line'], (subNode, node_path))
                 elif subNode['type'] in ('StructDefinition', 'EnumDefinition'):
                     for member in subNode['members']:
-                        if member['loc']['start']['line'] == line:
-                            node_path.extend(['member', '[*]'])
-                            return remove_loc_info(member), node_path
+                        node_index.setdefault(member['loc']['start']['line'], (member, node_path + ('member', '[*]')))
                 elif subNode['type'] in ('FunctionDefinition', 'ModifierDefinition'):
                     statements = get_attr(get_attr(subNode, 'body'), 'statements')
                     if statements:
                         for statement in statements:
-                            if statement['loc']['start']['line'] == line:
-                                node_path.extend(['body', 'statements', '[*]'])
-                                return remove_loc_info(statement), node_path
-    raise Exception('AST-Node not found')
+                            node_index.setdefault(statement['loc']['start']['line'],
+                                                  (statement, node_path + ('body', 'statements', '[*]')))
+    return node_index
+
+
+def find_node(node_index, line):
+    """Find the AST node reported for a line of code using an index from `build_node_index`
+
+    :param node_index: Node index of the contract file
+    :param line: line number
+    :return: (AST node without `loc` entries, node path)
+    """
+    try:
+        node, node_path = node_index[line]
+    except KeyError:
+        raise Exception('AST-Node not found')
+    return remove_loc_info(node), list(node_path)
+
+
+def get_node_and_node_path(node, line):
+    return find_node(build_node_index(node), line)